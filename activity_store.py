@@ -0,0 +1,200 @@
+"""Local on-disk store of Strava activities
+
+Activities are kept in a SQLite database (ACTIVITY_STORE) keyed by activity id.
+The raw activity JSON as returned by the API is stored as is, together with the
+start timestamp so that date range queries don't need to parse the JSON.
+
+The store also remembers which part of the timeline has already been synced
+(the `synced_after` timestamp). Anything between `synced_after` and the latest
+stored activity is known to be complete, so a sync only needs to ask Strava
+for activities newer than that.
+
+Photo lists are cached per activity and size along with the activity's photo
+count, so they are only fetched again when the photo count changes.
+
+API responses with an ETag are kept too (url -> etag, body), so that the
+client can make conditional requests (see strava_client.py).
+"""
+from datetime import datetime
+from itertools import islice
+import json
+import os
+import sqlite3
+import time
+
+ACTIVITY_STORE = os.path.join("data", "activities.sqlite")
+
+# Cached API responses not used for this long are dropped
+HTTP_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    start_ts REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS activities_start_ts ON activities (start_ts);
+CREATE TABLE IF NOT EXISTS photos (
+    activity_id INTEGER NOT NULL,
+    size TEXT NOT NULL,
+    photo_count INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (activity_id, size)
+);
+CREATE TABLE IF NOT EXISTS http_cache (
+    url TEXT PRIMARY KEY,
+    etag TEXT NOT NULL,
+    body TEXT NOT NULL,
+    used_ts REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def start_timestamp(activity):
+    """Return activity start as POSIX timestamp (start_date is in UTC)"""
+    return datetime.fromisoformat(activity["start_date"].replace("Z", "+00:00")).timestamp()
+
+
+def open_store(path=ACTIVITY_STORE):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def save_activities(conn, activities, batch_size=20):
+    """Insert or replace activities, returns the number of activities saved
+
+    Activities are committed in batches, so whatever was received is kept
+    even if `activities` fails part way (e.g. when the rate limit is hit).
+    """
+    activities = iter(activities)
+    saved = 0
+    while True:
+        rows = [(a["id"], start_timestamp(a), json.dumps(a)) for a in islice(activities, batch_size)]
+        if not rows:
+            return saved
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO activities (id, start_ts, data) VALUES (?, ?, ?)", rows
+            )
+        saved += len(rows)
+
+
+def delete_activity(conn, activity_id):
+    with conn:
+        conn.execute("DELETE FROM activities WHERE id = ?", (activity_id,))
+
+
+def load_activities(conn, after=None, before=None):
+    """Yield stored activities in the (after, before) interval, oldest first
+
+    The bounds are POSIX timestamps and are exclusive, same as the `after`
+    and `before` parameters of the Strava API.
+    """
+    query = "SELECT data FROM activities WHERE 1"
+    params = []
+    if after is not None:
+        query += " AND start_ts > ?"
+        params.append(after)
+    if before is not None:
+        query += " AND start_ts < ?"
+        params.append(before)
+    query += " ORDER BY start_ts"
+    for (data,) in conn.execute(query, params):
+        yield json.loads(data)
+
+
+def latest_start(conn, after):
+    """Return start timestamp of the newest activity starting after `after`"""
+    (latest,) = conn.execute(
+        "SELECT MAX(start_ts) FROM activities WHERE start_ts >= ?", (after,)
+    ).fetchone()
+    return latest
+
+
+def get_meta(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def set_meta(conn, key, value):
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value))
+        )
+
+
+def ranges_to_sync(conn, after, before=None):
+    """Return list of (after, before) intervals that need to be fetched from Strava
+
+    Only the part of the requested interval not yet covered by the store is
+    returned: anything older than what was synced so far, plus anything newer
+    than the latest stored activity.
+    """
+    synced_after = get_meta(conn, "synced_after")
+    if synced_after is None:
+        return [(after, before)]
+    ranges = []
+    if after < synced_after:
+        ranges.append((after, synced_after))
+    latest = latest_start(conn, synced_after)
+    if latest is None:
+        latest = synced_after
+    if before is None or latest < before:
+        ranges.append((latest, before))
+    return ranges
+
+
+def mark_synced(conn, after):
+    synced_after = get_meta(conn, "synced_after")
+    if synced_after is None or after < synced_after:
+        set_meta(conn, "synced_after", after)
+
+
+def load_photos(conn, activity_id, size, photo_count):
+    """Return cached photos of an activity, None if not cached or photo count changed"""
+    row = conn.execute(
+        "SELECT photo_count, data FROM photos WHERE activity_id = ? AND size = ?",
+        (activity_id, size),
+    ).fetchone()
+    if row is None or row[0] != photo_count:
+        return None
+    return json.loads(row[1])
+
+
+def save_photos(conn, activity_id, size, photo_count, photos):
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO photos (activity_id, size, photo_count, data) "
+            "VALUES (?, ?, ?, ?)",
+            (activity_id, size, photo_count, json.dumps(photos)),
+        )
+
+
+def load_http_cache(conn):
+    """Return dict {url: (etag, body)} of cached API responses"""
+    return {url: (etag, body) for url, etag, body in conn.execute(
+        "SELECT url, etag, body FROM http_cache"
+    )}
+
+
+def save_http_cache(conn, cache, used=None):
+    """Save cached API responses and drop the ones not used for a long time
+
+    Only entries with url in `used` (all if None) are saved and marked as used now.
+    """
+    now = time.time()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO http_cache (url, etag, body, used_ts) VALUES (?, ?, ?, ?)",
+            [(url, etag, body, now) for url, (etag, body) in cache.items()
+             if used is None or url in used],
+        )
+        conn.execute("DELETE FROM http_cache WHERE used_ts < ?", (now - HTTP_CACHE_MAX_AGE,))
@@ -0,0 +1,140 @@
+"""Local fake of the Strava API
+
+Serves a fixed list of activities the way Strava does:
+
+- GET /athlete/activities with after/before/page/per_page
+- GET /activities/{id}
+- GET /activities/{id}/photos with size
+- GET /activities/{id}/streams with keys (always keyed by type)
+- X-RateLimit-Limit/X-RateLimit-Usage headers on every response and
+  429 Too Many Requests once the 15-minute limit is used up
+
+Photo urls point to /photos/ of the fake itself, which serves placeholder
+images (not counted as API requests).
+
+build_map.py can be pointed to it with STRAVA_API_URL, e.g.:
+
+    python -m benchmarks.fake_strava --activities 1000 --port 8000 &
+    STRAVA_API_URL=http://127.0.0.1:8000 ./build_map.py --since 2024-03-01 ...
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import re
+import threading
+
+from activity_store import start_timestamp
+from benchmarks.synthetic import generate_activities, generate_photos, generate_streams
+
+# Not a real image, but enough to be mirrored and served
+PLACEHOLDER_PHOTO = b"\xff\xd8\xff\xe0" + bytes(2000)
+
+
+class FakeStrava(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, activities, address=("127.0.0.1", 0), limits=(100, 1000)):
+        super().__init__(address, FakeStravaHandler)
+        self.activities = sorted(activities, key=start_timestamp)
+        self.by_id = {activity["id"]: activity for activity in activities}
+        self.limits = limits
+        self.usage = [0, 0]
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def reset_usage(self):
+        """Start a new rate limit window"""
+        with self.lock:
+            self.usage = [0, 0]
+
+
+class FakeStravaHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-RateLimit-Limit", ",".join(map(str, self.server.limits)))
+        self.send_header("X-RateLimit-Usage", ",".join(map(str, self.server.usage)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_photo(self):
+        data = PLACEHOLDER_PHOTO + self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        server = self.server
+        if url.path.startswith("/photos/"):
+            self.send_photo()
+            return
+        with server.lock:
+            server.requests.append(url.path)
+            if any(usage >= limit for usage, limit in zip(server.usage, server.limits)):
+                self.send_json(429, {"message": "Rate Limit Exceeded"})
+                return
+            server.usage = [usage + 1 for usage in server.usage]
+
+        if url.path.endswith("/athlete/activities"):
+            self.list_activities(query)
+            return
+        match = re.search(r"/activities/(\d+)(/photos|/streams)?$", url.path)
+        if not match or int(match.group(1)) not in server.by_id:
+            self.send_json(404, {"message": "Record Not Found"})
+            return
+        activity = server.by_id[int(match.group(1))]
+        if match.group(2) == "/streams":
+            streams = generate_streams(activity, query.get("keys", "latlng").split(","))
+            self.send_json(200 if streams else 404, streams or {"message": "Record Not Found"})
+        elif match.group(2):
+            self.send_json(
+                200, generate_photos(activity, query.get("size", "100"), f"{server.url}/photos")
+            )
+        else:
+            self.send_json(200, activity)
+
+    def list_activities(self, query):
+        after = float(query.get("after", "-inf"))
+        before = float(query.get("before", "inf"))
+        per_page = int(query.get("per_page", 30))
+        page = int(query.get("page", 1))
+        matching = [
+            activity for activity in self.server.activities
+            if after < start_timestamp(activity) < before
+        ]
+        self.send_json(200, matching[(page - 1) * per_page:page * per_page])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic activities like Strava API")
+    parser.add_argument("--activities", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--limits", default="100,1000", help="15-minute and daily limit")
+    args = parser.parse_args()
+    limits = tuple(int(value) for value in args.limits.split(","))
+    server = FakeStrava(generate_activities(args.activities), ("127.0.0.1", args.port), limits)
+    print(f"Serving {args.activities} activities at {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Local fake of an XYZ tile server
+
+Serves a placeholder image for any /{layer}/{z}/{x}/{y}.{ext} and records
+the requested paths, so tile_cache.py can be tested (and its savings
+measured) without using any real tile quota, e.g.:
+
+    python -m benchmarks.fake_tiles --port 8001 &
+    THUNDERFOREST_TILE_URL='http://127.0.0.1:8001/outdoors/{z}/{x}/{y}.png?apikey={apikey}' \\
+        STADIA_TILE_URL='http://127.0.0.1:8001/terrain/{z}/{x}/{y}.jpg' \\
+        ./tile_cache.py seed --since 2024-03-01 --zoom 8-12
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import re
+import threading
+
+# Not a real image, but enough to be cached and served
+PLACEHOLDER_TILE = b"\x89PNG\r\n\x1a\n" + bytes(1000)
+
+
+class FakeTiles(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0)):
+        super().__init__(address, FakeTilesHandler)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+class FakeTilesHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        with self.server.lock:
+            self.server.requests.append(path)
+        if not re.fullmatch(r"/[\w-]+/\d+/\d+/\d+\.(png|jpg)", path):
+            self.send_error(404)
+            return
+        data = PLACEHOLDER_TILE + path.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve placeholder map tiles")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+    server = FakeTiles(("127.0.0.1", args.port))
+    print(f"Serving fake tiles at {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
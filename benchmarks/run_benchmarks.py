@@ -0,0 +1,115 @@
+"""Benchmarks of map building on synthetic activities
+
+For each number of activities this measures:
+
+- decoding all summary polylines one by one (decode_polyline) and in one
+  batch (decode_polylines)
+- a full build_map.py run against the local fake Strava API (fake_strava.py),
+  including the time per build phase reported by --stats-json
+- size of the resulting map
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.run_benchmarks --sizes 10 100 1000
+    python -m benchmarks.run_benchmarks --sizes 1000 -- --compact-routes
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_strava import FakeStrava
+from benchmarks.synthetic import generate_activities
+from polyline import decode_polyline, decode_polylines
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUILD_MAP = os.path.join(REPO_DIR, "build_map.py")
+SIZES = [10, 100, 1000, 10000]
+
+
+def best_time(function, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_decode(activities):
+    polylines = [activity["map"]["summary_polyline"] for activity in activities]
+    return {
+        "decode_polyline": best_time(lambda: [decode_polyline(p) for p in polylines]),
+        "decode_polylines": best_time(lambda: decode_polylines(polylines)),
+    }
+
+
+def benchmark_build(activities, build_args):
+    """Run build_map.py against fake API serving `activities`, return results"""
+    server = FakeStrava(activities, limits=(10 ** 9, 10 ** 9)).start()
+    since = activities[0]["start_date_local"][:10]
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Valid token, so that no authentication is needed
+        with open(os.path.join(work_dir, "token.json"), "w") as f:
+            json.dump({"access_token": "benchmark", "refresh_token": "benchmark",
+                       "expires_at": time.time() + 24 * 3600}, f)
+        env = dict(os.environ, STRAVA_API_URL=server.url)
+        command = [
+            sys.executable, BUILD_MAP, "--skip-thunderforest", "--since", since,
+            "--until", "2100-01-01", "-o", "map.html", "--stats-json", "stats.json",
+            *build_args,
+        ]
+        start = time.perf_counter()
+        subprocess.run(command, cwd=work_dir, env=env, check=True, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        with open(os.path.join(work_dir, "stats.json")) as f:
+            stats = json.load(f)
+        map_size = os.path.getsize(os.path.join(work_dir, "map.html"))
+    server.shutdown()
+    server.server_close()
+    return {
+        "build": elapsed,
+        "phases": {name: phase["seconds"] for name, phase in stats["phases"].items()},
+        "api_requests": len(server.requests),
+        "map_bytes": map_size,
+        "output_bytes": stats["counters"].get("output bytes", map_size),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark map building on synthetic activities. "
+        "Arguments after -- are passed to build_map.py."
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help=f"Numbers of activities (default: {SIZES})")
+    parser.add_argument("--photos", action="store_true", help="Include photos in the build")
+    parser.add_argument("--json", metavar="PATH", help="Write results as JSON")
+    parser.add_argument("build_args", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    build_args = list(args.build_args)
+    if not args.photos:
+        build_args.append("--skip-photos")
+
+    results = {}
+    print(f"{'activities':>10} {'decode 1by1':>12} {'decode batch':>12} "
+          f"{'build':>8} {'requests':>8} {'map.html':>12}")
+    for size in args.sizes:
+        activities = generate_activities(size)
+        result = benchmark_decode(activities)
+        result.update(benchmark_build(activities, build_args))
+        results[size] = result
+        print(f"{size:>10} {result['decode_polyline']:>11.3f}s {result['decode_polylines']:>11.3f}s "
+              f"{result['build']:>7.2f}s {result['api_requests']:>8} {result['map_bytes']:>12}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
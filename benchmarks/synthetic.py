@@ -0,0 +1,123 @@
+"""Synthetic Strava activities for benchmarks
+
+Activities look like those returned by /athlete/activities: a multi-day trip
+with one or two activities per day, each with a realistic encoded
+summary_polyline (a random walk with a slowly changing heading, roughly one
+point per 60 m, like Strava's summary polylines). generate_streams() gives
+the full resolution streams of an activity, a point every few meters.
+"""
+from datetime import datetime, timedelta, timezone
+import math
+import random
+
+from polyline import decode_polyline, encode_polyline
+
+POINT_SPACING = 60  # meters
+STREAM_SPACING = 5  # meters
+TYPES = ["Hike"] * 8 + ["Walk", "Run"]
+
+
+def random_route(rng, lat, lng, distance):
+    """Return list of (lat, lng) points of a random walk `distance` meters long"""
+    heading = rng.uniform(0, 2 * math.pi)
+    points = [(lat, lng)]
+    for _ in range(max(2, int(distance / POINT_SPACING))):
+        heading += rng.gauss(0, 0.3)
+        step = rng.uniform(0.5, 1.5) * POINT_SPACING
+        lat += step * math.cos(heading) / 111320
+        lng += step * math.sin(heading) / (111320 * math.cos(math.radians(lat)))
+        points.append((lat, lng))
+    return points
+
+
+def generate_activities(count, start=datetime(2024, 3, 15, 7, tzinfo=timezone.utc),
+                        seed=0, photo_ratio=0.3):
+    """Return `count` activities, oldest first, starting at `start`"""
+    rng = random.Random(seed)
+    lat, lng = 31.33, -110.0  # Arizona Trail southern terminus
+    activities = []
+    for i in range(count):
+        day = i // 2 + 1
+        start_date = start + timedelta(days=day - 1, hours=(i % 2) * 6)
+        distance = rng.uniform(5000, 35000)
+        points = random_route(rng, lat, lng, distance)
+        lat, lng = points[-1]
+        photo_count = rng.randint(1, 6) if rng.random() < photo_ratio else 0
+        activities.append({
+            "id": 10000000000 + i,
+            "name": f"AZT Day {day}" if i % 2 == 0 else f"AZT Day {day} afternoon",
+            "type": rng.choice(TYPES),
+            "distance": round(distance, 1),
+            "total_elevation_gain": round(distance * rng.uniform(0.01, 0.05), 1),
+            "start_date": start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "start_date_local": (start_date - timedelta(hours=7)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "timezone": "(GMT-07:00) America/Phoenix",
+            "map": {
+                "id": f"a{10000000000 + i}",
+                "summary_polyline": encode_polyline(points),
+                "resource_state": 2,
+            },
+            "photo_count": 0,
+            "total_photo_count": photo_count,
+        })
+    return activities
+
+
+def generate_photos(activity, size, photo_url="https://example.com/photos"):
+    """Return photos of an activity as returned by /activities/{id}/photos"""
+    rng = random.Random(activity["id"])
+    points = decode_polyline(activity["map"]["summary_polyline"] or "")
+    photos = []
+    for i in range(activity["total_photo_count"]):
+        photo = {
+            "unique_id": f"{activity['id']}-{i}",
+            "activity_id": activity["id"],
+            "urls": {size: f"{photo_url}/{activity['id']}/{i}-{size}.jpg"},
+            "sizes": {size: [int(size), int(int(size) * 0.75)]},
+            "source": 1,
+        }
+        if points:
+            photo["location"] = list(rng.choice(points))
+        photos.append(photo)
+    return photos
+
+
+def generate_streams(activity, keys):
+    """Return streams of an activity as returned by /activities/{id}/streams?key_by_type=true
+
+    The summary polyline is densified to a point every STREAM_SPACING meters
+    with some GPS noise, altitude follows a few rolling hills.
+    """
+    rng = random.Random(activity["id"])
+    summary = decode_polyline(activity["map"]["summary_polyline"] or "")
+    if not summary:
+        return {}
+    latlng = [summary[0]]
+    distance = [0.0]
+    for (lat0, lng0), (lat1, lng1) in zip(summary, summary[1:]):
+        dy = (lat1 - lat0) * 111320
+        dx = (lng1 - lng0) * 111320 * math.cos(math.radians(lat0))
+        length = math.hypot(dx, dy)
+        steps = max(1, round(length / STREAM_SPACING))
+        for step in range(1, steps + 1):
+            t = step / steps
+            latlng.append([
+                round(lat0 + (lat1 - lat0) * t + rng.gauss(0, 0.00001), 6),
+                round(lng0 + (lng1 - lng0) * t + rng.gauss(0, 0.00001), 6),
+            ])
+            distance.append(round(distance[-1] + length / steps, 1))
+    hills = [(rng.uniform(100, 400), rng.uniform(1000, 6000), rng.uniform(0, 2 * math.pi)) for _ in range(3)]
+    streams = {
+        "latlng": latlng,
+        "distance": distance,
+        "altitude": [
+            round(1200 + sum(height * math.sin(d / length + phase) for height, length, phase in hills), 1)
+            for d in distance
+        ],
+        "time": [round(d / 1.2) for d in distance],
+    }
+    return {
+        key: {"data": streams[key], "series_type": "distance", "original_size": len(latlng),
+              "resolution": "high"}
+        for key in keys if key in streams
+    }
@@ -1,35 +1,64 @@
 #!/usr/bin/env python3
 """Build folium map from Strava activities using Strava API
 
-User activities are loaded from newest to oldest. They are paged by 20 items.
-For each activity there are extra 2 api requests to get photos. The api rate limit
-is 100 requests per 15 minutes. This means 48 is the maximum amount of activities
-that can be loaded at once.
+User activities are listed PER_PAGE (200) at a time, the next page loads
+while the activities of the current one are processed (see strava_client.py).
+For each activity with photos there are extra 2 api requests to get photos,
+sent while later pages of the listing are still loading. All requests stay
+within the api rate limit (see rate_limit.py). Photos are fetched concurrently
+and cached locally per activity (see activity_store.py), so they are only
+requested again when the activity's photo count changes. Decoding and
+rendering start once the whole list is in, the fingerprint, map bounds and
+day labels need every activity.
 
 The date boundaries for activities are set via SINCE/UNTIL constants
-here at the top of the script.
+here at the top of the script. Maps of several trips (see trips.py) can be
+built at once with --trips, sharing a single fetch of the activities.
+
+API responses can be recorded with --record and the build rerun from them
+with --replay, without network access (see cassette.py).
+
+Each successful build remembers a fingerprint of its inputs (see
+fingerprint.py). With --skip-unchanged the map isn't rendered again when the
+fingerprint is the same and the script exits with EXIT_UNCHANGED, so the
+caller can skip deployment too.
 
 Required env vars (either already set, or via .env file):
 THUNDERFOREST_API_KEY
 """
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 import argparse
+import cProfile
 import os
-import re
+import sys
 
-import requests
 import folium
 from folium.plugins import Fullscreen, MarkerCluster
 
 from get_access_token import get_access_token
+import activity_store
+from cassette import Cassette, CassetteMiss
+import dedup
+from fingerprint import input_fingerprint
+import heatmap
+import photo_mirror
+from build_stats import STATS, BuildStats
+import rate_limit
+import simplify
+import strava_client
+import streams
+import trip_stats
+from strava_client import StravaAPIError, StravaClient, date_to_timestamp
+from route_layer import RouteLayer, make_ids_stable
+from polyline import decode_polylines
+from track import Track, merge_bounds, tracks_from_decoded
+from trips import TRIPS_CONFIG, TRIPS_OUTPUT_DIR, load_trips
 
-ACTIVITIES_ENDPOINT = "https://www.strava.com/api/v3/athlete/activities"
 PHOTO_THUMB_SIZE = "64"
 PHOTO_LARGE_SIZE = "400"
-
-# South Africa 2026
-# SINCE = "2026-03-03"
-# UNTIL = "2026-03-25"
+PHOTO_WORKERS = strava_client.POOL_SIZE
 
 # Taiwan 2026
 SINCE = "2026-04-24"
@@ -37,76 +66,8 @@ UNTIL = "2026-05-07"
 FIRST_DAY = None  # If set, this date will be Day 1 (defaults to SINCE)
 
 
-# Hong Kong 2024
-# SINCE = "2024-12-27"
-# UNTIL = "2025-01-07"
-
-# Alps 2024
-# SINCE = "2024-06-29"
-# UNTIL = "2024-07-07"
-
-# Arizona Trail 2024
-# SINCE = "2024-03-15"
-# UNTIL = "2024-04-28"
-
-# La Palma 2023
-# SINCE = "2023-11-29"
-# UNTIL = "2023-12-07"
-
-# Chamonix to Zermatt 2023
-# SINCE = "2023-09-23"
-# UNTIL = "2023-10-02"
-
-# Italy 2023
-# SINCE = "2023-06-23"
-# UNTIL = "2023-07-11"
-
-# Chile 2023
-# SINCE = "2023-03-02"
-# UNTIL = "2023-03-27"
-
-# Scotland Fall 2022
-# SINCE = "2022-09-26"
-# UNTIL = "2022-10-07"
-
-# France 2022
-# SINCE = "2022-07-01"
-# UNTIL = "2022-07-11"
-
-# Scotland 2022
-# SINCE = "2022-04-14"
-# UNTIL = "2022-04-24"
-
-# Nepal 2021
-# SINCE = "2021-11-21"
-# UNTIL = "2021-12-04"
-
-# Slovenia
-# SINCE = "2020-06-12"
-# UNTIL = "2020-06-22"
-
-# Switzerland 2019
-# SINCE = "2019-06-29"
-# UNTIL = "2019-07-14"
-# UNTIL = "2019-07-05"
-
-# NZ 2017/2018
-# SINCE = "2017-12-04"
-# UNTIL = "2018-02-15"
-
-# Canary Islands 2021
-# SINCE = "2021-02-26"
-# SINCE = "2021-04-09"
-# UNTIL = "2021-04-19"
-
-# Switzerland 2021
-# SINCE = "2021-06-27"
-# SINCE = "2021-07-16"
-# UNTIL = "2021-08-08"
-
-# Fuerteventura Fall 2021
-# SINCE = "2021-10-25"
-# UNTIL = "2021-11-06"
+# Exit status with --skip-unchanged when no map had to be rendered
+EXIT_UNCHANGED = 3
 
 
 def parse_arguments(argv=None):
@@ -127,6 +88,11 @@ def parse_arguments(argv=None):
         default="map.html",
         help="Output file path (default: map.html)",
     )
+    parser.add_argument(
+        "--csv",
+        default="hikes.csv",
+        help="Output file path for hike stats (default: hikes.csv)",
+    )
     parser.add_argument(
         "--since",
         help="Start date for activities in ISO format (YYYY-MM-DD). Defaults to SINCE constant or 1 month ago.",
@@ -135,103 +101,363 @@ def parse_arguments(argv=None):
         "--until",
         help="End date for activities in ISO format (YYYY-MM-DD). Defaults to UNTIL constant if set.",
     )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Keep activities in a local store and only fetch activities newer than "
+        f"the latest stored one (store: {activity_store.ACTIVITY_STORE}).",
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=int,
+        default=rate_limit.MAX_WAIT,
+        help="Maximum number of seconds to pause when the Strava rate limit is reached. "
+        f"The build fails if it would take longer (default: {rate_limit.MAX_WAIT}).",
+    )
+    parser.add_argument(
+        "--simplify",
+        type=float,
+        metavar="METERS",
+        help="Simplify routes (Douglas-Peucker) with the given tolerance in meters "
+        "to make the map smaller. E.g. 10 hardly changes how routes look.",
+    )
+    parser.add_argument(
+        "--dedup-routes",
+        type=float,
+        nargs="?",
+        const=dedup.TOLERANCE,
+        metavar="METERS",
+        help="Don't draw sections of routes again that overlap earlier routes (or an earlier part "
+        "of the same route, e.g. the way back of an out-and-back hike) within METERS "
+        f"(default: {dedup.TOLERANCE}). Activity pins and popups stay. Needs NumPy.",
+    )
+    parser.add_argument(
+        "--compact-routes",
+        action="store_true",
+        help="Write all routes as one compact data payload drawn by a small script "
+        "instead of separate map objects per activity. Makes the map much smaller.",
+    )
+    parser.add_argument(
+        "--split-data",
+        action="store_true",
+        help="Write the map page (which stays the same between builds) and the activity "
+        "data separately: a content-hashed data file plus <map>-data.json pointing to "
+        "it. Only these need to be deployed when the page didn't change. "
+        "Implies --compact-routes.",
+    )
+    parser.add_argument(
+        "--cluster-markers",
+        action="store_true",
+        help="Cluster activity pins and photos per zoom level when building the map instead "
+        "of in the browser. The page then only creates markers of clusters that are expanded. "
+        "Implies --compact-routes.",
+    )
+    parser.add_argument(
+        "--heatmap",
+        action="store_true",
+        help="Draw routes as a heatmap instead of vector lines: a tile pyramid written to "
+        "<map>-heatmap/ next to the map, shown as a tile layer. Needs NumPy.",
+    )
+    parser.add_argument(
+        "--heatmap-max-zoom",
+        type=int,
+        default=heatmap.MAX_ZOOM,
+        help=f"Highest zoom level of heatmap tiles (default: {heatmap.MAX_ZOOM})",
+    )
+    parser.add_argument(
+        "--mirror-photos",
+        action="store_true",
+        help="Download photos into a local cache (LRU, max "
+        f"{photo_mirror.PHOTO_CACHE_SIZE // 2 ** 20} MB in {photo_mirror.PHOTO_CACHE}), inline "
+        "the thumbnails into the map and copy the large photos to <map>-photos/ next to it.",
+    )
+    parser.add_argument(
+        "--streams",
+        action="store_true",
+        help="Draw routes from full resolution activity streams instead of summary polylines. "
+        f"Streams are fetched once per activity and kept in {streams.STREAMS_DIR}. Routes are "
+        f"simplified with --simplify (default: {streams.ROUTE_TOLERANCE} m). Needs NumPy.",
+    )
+    parser.add_argument(
+        "--tile-proxy",
+        metavar="URL",
+        help="Load Thunderforest and Stadia Maps tiles through this tile_cache.py proxy "
+        "instead of directly, so views don't use up their quota and the Thunderforest "
+        "API key isn't needed in the page.",
+    )
+    parser.add_argument(
+        "--trips",
+        nargs="?",
+        const=TRIPS_CONFIG,
+        metavar="CONFIG",
+        help=f"Build maps of all trips in the trips config (default: {TRIPS_CONFIG}) "
+        "with a single fetch of activities. Each trip has name, since and optionally "
+        f"until, first_day, output and csv (default: {TRIPS_OUTPUT_DIR}/<name>.html/.csv).",
+    )
+    parser.add_argument(
+        "--trip",
+        action="append",
+        metavar="NAME",
+        help="Only build this trip from the trips config (can be repeated)",
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        help="Number of maps rendered in parallel with --trips (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--stats-json",
+        metavar="PATH",
+        help="Write build stats (time per phase, API requests, output size) as JSON",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="Profile the whole build with cProfile and dump the stats to PATH",
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help="Don't render maps whose inputs (activities, photos, options) are the same as "
+        f"in the last successful build. Exits with status {EXIT_UNCHANGED} if nothing was rendered.",
+    )
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument(
+        "--record",
+        metavar="CASSETTE",
+        help="Record all Strava API responses of the build to a compressed cassette file. "
+        "The local caches are bypassed, so that the cassette has everything the build needs.",
+    )
+    cassette.add_argument(
+        "--replay",
+        metavar="CASSETTE",
+        help="Build from API responses recorded with --record, without any network calls.",
+    )
     parser.add_argument(
         "--first-day",
         help="Date to use as Day 1 for day number labels in ISO format (YYYY-MM-DD). Defaults to FIRST_DAY constant or since date.",
     )
     args = parser.parse_args(argv)
+    if args.sync and (args.record or args.replay):
+        parser.error("--sync can't be combined with --record/--replay")
+    if args.heatmap and heatmap.np is None:
+        parser.error("--heatmap needs NumPy")
+    if args.dedup_routes and dedup.np is None:
+        parser.error("--dedup-routes needs NumPy")
+    if args.dedup_routes and args.heatmap:
+        parser.error("--dedup-routes can't be combined with --heatmap, which draws no route lines")
+    if args.streams and streams.np is None:
+        parser.error("--streams needs NumPy")
     return args
 
 
-def decode_polyline(polyline_str):
+def sync_activities(client, since, until=None, store_path=activity_store.ACTIVITY_STORE):
+    """Sync activities into the local store and return them from there
+
+    Only the parts of the date range not yet in the store are fetched from
+    Strava, i.e. typically just the activities newer than the latest stored one.
     """
-    Copied from https://stackoverflow.com/a/33557576
+    after = date_to_timestamp(since)
+    before = date_to_timestamp(until)
+    conn = activity_store.open_store(store_path)
+    fetched = 0
+    # Progress is saved as we go, so a sync aborted by the rate limit can resume
+    for range_after, range_before in activity_store.ranges_to_sync(conn, after, before):
+        fetched += activity_store.save_activities(
+            conn, client.get_activities(after=range_after, before=range_before)
+        )
+    # Only reached once all ranges were listed completely (get_activities()
+    # raises otherwise), or activities never fetched would count as synced
+    activity_store.mark_synced(conn, after)
+    print(f"Fetched {fetched} new activities into {store_path}")
+    activities = list(activity_store.load_activities(conn, after=after, before=before))
+    conn.close()
+    return activities
+
+
+def fetch_photos(client, activities, sizes=(PHOTO_THUMB_SIZE, PHOTO_LARGE_SIZE),
+                 store_path=activity_store.ACTIVITY_STORE, max_workers=PHOTO_WORKERS):
+    """Get photos of all activities for each of the sizes
+
+    Returns dict {(activity_id, size): photos}. Photos are served from the local
+    cache unless the activity's photo count changed, the rest is fetched
+    concurrently over the client's session. Requests are sent while going over
+    `activities`, which may be a generator still listing them. Activities
+    without photos need no request at all. With `store_path` None the cache
+    is not used.
+    """
+    conn = activity_store.open_store(store_path) if store_path else None
+    photos = {}
+    missing = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for activity in activities:
+            photo_count = activity.get("total_photo_count", 0)
+            for size in sizes:
+                key = (activity["id"], size)
+                if not photo_count:
+                    photos[key] = []
+                    continue
+                cached = activity_store.load_photos(conn, activity["id"], size, photo_count) if conn else None
+                if cached is None:
+                    missing[key] = (executor.submit(client.get_activity_photos, *key), photo_count)
+                else:
+                    photos[key] = cached
+
+        if missing:
+            print(f"Fetching photos: {len(missing)} requests")
+        for key, (future, photo_count) in missing.items():
+            result = future.result()
+            photos[key] = result
+            # Empty result for an activity with photos means the request failed
+            if result and conn:
+                activity_store.save_photos(conn, *key, photo_count, result)
+    if conn:
+        conn.close()
+    return photos
+
+
+def fetch_activities(args, client, since, until, include=None):
+    """Fetch activities with their photos (and streams with --streams)
+
+    Returns (activities, photos), see fetch_photos(). Unless syncing, photos
+    of the activities listed so far are requested while the following pages
+    of the listing are still loading, streams only once it is complete. Only
+    photo requests overlap the listing, the caller gets the activities when
+    all of them are in. With `include` (a function taking an activity)
+    photos and streams are only fetched for activities it accepts.
     """
-    index, lat, lng = 0, 0, 0
-    coordinates = []
-    changes = {"latitude": 0, "longitude": 0}
-
-    # Coordinates have variable length when encoded, so just keep
-    # track of whether we've hit the end of the string. In each
-    # while loop iteration, a single coordinate is decoded.
-    while index < len(polyline_str):
-        # Gather lat/lon changes, store them in a dictionary to apply them later
-        for unit in ["latitude", "longitude"]:
-            shift, result = 0, 0
-
-            while True:
-                byte = ord(polyline_str[index]) - 63
-                index += 1
-                result |= (byte & 0x1F) << shift
-                shift += 5
-                if not byte >= 0x20:
-                    break
-
-            if result & 1:
-                changes[unit] = ~(result >> 1)
+
+    def wanted(activities):
+        for activity in activities:
+            if activity["map"]["summary_polyline"] and (include is None or include(activity)):
+                yield activity
+
+    photos = {}
+    if args.sync or args.skip_photos:
+        with STATS.phase("fetch activities"):
+            if args.sync:
+                activities = sync_activities(client, since=since, until=until)
             else:
-                changes[unit] = result >> 1
+                activities = list(client.get_activities(since=since, until=until))
+        if not args.skip_photos:
+            with STATS.phase("fetch photos"):
+                photos = fetch_photos(client, wanted(activities), store_path=photo_store(args))
+    else:
+        activities = []
+
+        def listed():
+            for activity in client.get_activities(since=since, until=until):
+                activities.append(activity)
+                yield activity
+
+        with STATS.phase("fetch activities and photos"):
+            photos = fetch_photos(client, wanted(listed()), store_path=photo_store(args))
+    if args.streams:
+        with STATS.phase("fetch streams"):
+            STATS.count("streams fetched", streams.fetch_streams(
+                client, wanted(activities), refresh=bool(args.record),
+                max_workers=PHOTO_WORKERS,
+            ))
+    STATS.record_rate_limit(client.rate_limiter)
+    return activities, photos
+
+
+def create_client(args):
+    if args.replay:
+        return StravaClient(None, stats=STATS, cassette=Cassette(args.replay, replay=True))
+    with STATS.phase("authentication"):
+        access_token = get_access_token()
+    if args.record:
+        client = StravaClient(access_token, stats=STATS, cassette=Cassette(args.record))
+    else:
+        client = StravaClient(access_token, store_path=activity_store.ACTIVITY_STORE, stats=STATS)
+    client.rate_limiter.max_wait = args.max_wait
+    return client
+
+
+def photo_store(args):
+    """Path of the photo cache, None when recording/replaying API responses"""
+    return None if args.record or args.replay else activity_store.ACTIVITY_STORE
+
+
+def build_settings(args, since, until, first_day, output, csv_path):
+    """Everything besides activities and photos that affects the output"""
+    return {
+        "since": since,
+        "until": until,
+        "first_day": first_day,
+        "output": output,
+        "csv": csv_path,
+        "skip_photos": args.skip_photos,
+        "thunderforest": None if args.skip_thunderforest else os.environ.get("THUNDERFOREST_API_KEY"),
+        "tile_proxy": args.tile_proxy,
+        "simplify": args.simplify,
+        "dedup_routes": args.dedup_routes,
+        "compact_routes": args.compact_routes,
+        "split_data": args.split_data,
+        "cluster_markers": args.cluster_markers,
+        "heatmap_max_zoom": args.heatmap_max_zoom if args.heatmap else None,
+        "mirror_photos": args.mirror_photos,
+        "streams": args.streams,
+    }
 
-        lat += changes["latitude"]
-        lng += changes["longitude"]
 
-        coordinates.append((lat / 100000.0, lng / 100000.0))
+def fingerprint_key(output):
+    return f"fingerprint {os.path.abspath(output)}"
 
-    return coordinates
 
+def is_unchanged(fingerprint, output, csv_path, store_path=activity_store.ACTIVITY_STORE):
+    """True if the last successful build of `output` had the same fingerprint"""
+    if not (os.path.isfile(output) and os.path.isfile(csv_path)):
+        return False
+    conn = activity_store.open_store(store_path)
+    previous = activity_store.get_meta(conn, fingerprint_key(output))
+    conn.close()
+    return previous == fingerprint
 
-def get_activities(access_token, since=None, until=None):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    payload = {"per_page": 20}
-    if since:
-        payload["after"] = datetime.fromisoformat(since).timestamp()
-    if until:
-        payload["before"] = datetime.fromisoformat(until).timestamp()
-    payload["page"] = 1
-    while True:
-        response = requests.get(
-            ACTIVITIES_ENDPOINT,
-            headers=headers,
-            params=payload,
-        )
-        if response.status_code != requests.codes.ok:
-            print("Failed to get activities")
-            print(f"Request url: {ACTIVITIES_ENDPOINT}")
-            print(f"Request headers: {headers}")
-            print(f"Request payload: {payload}")
-            print(f"Status code: {response.status_code}")
-            print(f"Response: {response.text}")
-            break
-        activities = response.json()
-        if activities:
-            payload["page"] += 1
-            yield from activities
-        else:
-            break
-
-
-def get_activity_photos(access_token, activity_id, size=None):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    payload = {"photo_sources": True}
-    if size is not None:
-        payload["size"] = size
-    response = requests.get(
-        f"https://www.strava.com/api/v3/activities/{activity_id}/photos",
-        headers=headers,
-        params=payload,
-    )
-    if response.status_code != requests.codes.ok:
-        print("Failed to get photos, skipping...")
-        print(f"Status code: {response.status_code}")
-        print(f"Response: {response.text}")
-        return []
-    return response.json()
+
+def save_fingerprint(fingerprint, output, store_path=activity_store.ACTIVITY_STORE):
+    conn = activity_store.open_store(store_path)
+    activity_store.set_meta(conn, fingerprint_key(output), fingerprint)
+    conn.close()
 
 
 def main():
     args = parse_arguments()
-    access_token = get_access_token()
-
+    profile = cProfile.Profile() if args.profile else None
+    if profile:
+        profile.enable()
+    try:
+        if args.trips:
+            rendered = build_trips(args)
+        else:
+            rendered = build(args)
+    except rate_limit.RateLimitExceeded as e:
+        print(f"Build aborted: {e}")
+        if args.sync or not args.skip_photos:
+            print("Data fetched so far is kept in the local store, rerun later to continue")
+        sys.exit(1)
+    except StravaAPIError as e:
+        print(f"Build aborted: {e}")
+        sys.exit(1)
+    except CassetteMiss as e:
+        print(f"Replay failed: {e}")
+        sys.exit(1)
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.profile)
+            print(f"Profile saved to: {args.profile}")
+        STATS.print_summary()
+        if args.stats_json:
+            STATS.write_json(args.stats_json)
+    if not rendered:
+        print("Nothing changed since the last build")
+        sys.exit(EXIT_UNCHANGED)
+
+
+def build(args):
+    """Build the map, returns False if it was skipped as unchanged"""
     # Determine date range: CLI args override constants, default since to 1 month ago
     since = args.since if args.since else SINCE
     if not since:
@@ -246,17 +472,173 @@ def main():
         # Default to since date
         first_day = since
 
-    activities = get_activities(access_token, since=since, until=until)
+    with create_client(args) as client:
+        activities, photos = fetch_activities(args, client, since, until)
+
+    fingerprint = input_fingerprint(
+        activities, photos, build_settings(args, since, until, first_day, args.output, args.csv)
+    )
+    if args.skip_unchanged and is_unchanged(fingerprint, args.output, args.csv):
+        print(f"Map unchanged: {args.output}")
+        return False
+    render_map(args, activities, photos, first_day, args.output, args.csv)
+    save_fingerprint(fingerprint, args.output)
+    return True
+
+
+def build_trips(args):
+    """Build maps of all trips from the trips config
+
+    Activities for the whole date range of all trips are fetched (or synced)
+    once, photos and streams only of those within a trip. They are split by
+    trip using a sorted index of start times and the maps are then rendered
+    in parallel processes. Returns False if all of them were skipped as
+    unchanged.
+    """
+    trips = load_trips(args.trips, args.trip)
+
+    since = min(trip["since"] for trip in trips)
+    untils = [trip["until"] for trip in trips]
+    until = None if None in untils else max(untils)
+    ranges = [(date_to_timestamp(trip["since"]), date_to_timestamp(trip["until"])) for trip in trips]
+
+    def in_trip(activity):
+        # Activities between trips are listed, but their photos and streams aren't needed
+        start = activity_store.start_timestamp(activity)
+        return any(after < start and (before is None or start < before) for after, before in ranges)
+
+    with create_client(args) as client:
+        activities, photos = fetch_activities(args, client, since, until, include=in_trip)
+    activities.sort(key=activity_store.start_timestamp)
+    start_times = [activity_store.start_timestamp(activity) for activity in activities]
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {}
+        for trip in trips:
+            # Same bounds as the Strava API: start > since and start < until
+            lo = bisect_right(start_times, date_to_timestamp(trip["since"]))
+            hi = bisect_left(start_times, date_to_timestamp(trip["until"])) if trip["until"] else None
+            trip_activities = activities[lo:hi]
+            trip_ids = {activity["id"] for activity in trip_activities}
+            trip_photos = {key: value for key, value in photos.items() if key[0] in trip_ids}
+            settings = build_settings(
+                args, trip["since"], trip["until"], trip["first_day"], trip["output"], trip["csv"]
+            )
+            fingerprint = input_fingerprint(trip_activities, trip_photos, settings)
+            if args.skip_unchanged and is_unchanged(fingerprint, trip["output"], trip["csv"]):
+                print(f"{trip['name']}: unchanged")
+                continue
+            os.makedirs(os.path.dirname(trip["output"]) or ".", exist_ok=True)
+            print(f"{trip['name']}: {len(trip_activities)} activities")
+            # Renders running in parallel would remove photos the others just fetched
+            future = executor.submit(
+                render_map, args, trip_activities, trip_photos, trip["first_day"],
+                trip["output"], trip["csv"], BuildStats(), evict_photos=False,
+            )
+            futures[future] = (fingerprint, trip["output"])
+        for future, (fingerprint, output) in futures.items():
+            STATS.merge(future.result())
+            save_fingerprint(fingerprint, output)
+    if futures and args.mirror_photos and not args.skip_photos:
+        # Once all maps are rendered, keeping the photos of all trips
+        mirror = photo_mirror.PhotoMirror()
+        mirror.evict(keep=[mirror.path(url) for urls in photo_urls(photos).values() for url in urls])
+    return bool(futures)
+
+
+def photo_urls(photos):
+    """Return {size: urls} of photos with a location (those shown on the map)"""
+    urls = {PHOTO_THUMB_SIZE: [], PHOTO_LARGE_SIZE: []}
+    for (_, size), size_photos in photos.items():
+        urls[size].extend(photo["urls"][size] for photo in size_photos if "location" in photo)
+    return urls
+
+
+def mirror_photos(photos, output, stats=STATS, evict=True):
+    """Mirror all photos locally, return {photo url: url to use in the map instead}
+
+    Thumbnails become data URIs, large photos are copied to <map>-photos/
+    next to `output`. Photos that failed to download keep their url. Without
+    `evict` the cache isn't trimmed afterwards, see build_trips().
+    """
+    urls = photo_urls(photos)
+    mirror = photo_mirror.PhotoMirror()
+    paths = mirror.fetch(urls[PHOTO_THUMB_SIZE] + urls[PHOTO_LARGE_SIZE])
+    photos_dir = f"{os.path.splitext(os.path.basename(output))[0]}-photos"
+    published = photo_mirror.publish(
+        {paths[url] for url in urls[PHOTO_LARGE_SIZE] if paths[url]},
+        os.path.join(os.path.dirname(output), photos_dir),
+    )
+    if evict:
+        mirror.evict(keep=paths.values())
+    stats.count("photos downloaded", mirror.downloaded)
+
+    mirrored = {}
+    for url in urls[PHOTO_THUMB_SIZE]:
+        if paths[url]:
+            mirrored[url] = photo_mirror.data_uri(paths[url])
+    for url in urls[PHOTO_LARGE_SIZE]:
+        if paths[url]:
+            mirrored[url] = f"{photos_dir}/{published[paths[url]]}"
+    return mirrored
+
+
+def activities_with_routes(activities):
+    return [activity for activity in activities if activity["map"]["summary_polyline"]]
+
 
+def render_map(args, activities, photos, first_day, output, csv_path, stats=STATS, evict_photos=True):
+    """Render map of the activities to `output` and their stats to `csv_path`
+
+    `photos` is the dict returned by fetch_photos() (not used with
+    --skip-photos). Only needs picklable arguments, so that several maps can be
+    rendered in parallel processes (see build_trips()). Returns `stats`.
+    Without `evict_photos` the photo cache is left as is by --mirror-photos.
+    """
+    # Decode all routes in one batch (vectorized when NumPy is available)
+    with stats.phase("decode polylines"):
+        coordinates, offsets = decode_polylines(
+            activity["map"]["summary_polyline"] or "" for activity in activities
+        )
+        stream_points = [0] * len(activities)
+        if args.streams:
+            # Simplified as each stream is read, full resolution streams are never all in memory
+            coordinates, offsets, stream_points = streams.replace_routes(
+                activities, coordinates, offsets, args.simplify or streams.ROUTE_TOLERANCE
+            )
+            stats.count("routes from streams", sum(1 for count in stream_points if count))
+            stats.count("stream points", sum(stream_points))
+        tracks = tracks_from_decoded(activities, coordinates, offsets)
+    stats.count("points decoded", len(coordinates))
+    if args.heatmap:
+        heatmap_dir = f"{os.path.splitext(os.path.basename(output))[0]}-heatmap"
+        with stats.phase("heatmap tiles"):
+            tile_count = heatmap.render_tiles(
+                coordinates, offsets, os.path.join(os.path.dirname(output), heatmap_dir),
+                args.heatmap_max_zoom, args.jobs,
+            )
+        stats.count("heatmap tiles", tile_count)
+    del coordinates
+
+    mirrored = {}
+    if args.mirror_photos and not args.skip_photos:
+        with stats.phase("mirror photos"):
+            mirrored = mirror_photos(photos, output, stats, evict=evict_photos)
+
+    stats.start_phase("build map")
     # Parse first_day date for day number calculation (first_day = day 1)
     first_day_date = datetime.fromisoformat(first_day).date()
 
     the_map = folium.Map(tiles=None, control_scale=True)
 
     if not args.skip_thunderforest:
-        tf_api_key = os.environ["THUNDERFOREST_API_KEY"]
-        tf_tiles = "https://tile.thunderforest.com/outdoors/{z}/{x}/{y}{r}.png?apikey="
-        tf_tiles += tf_api_key
+        if args.tile_proxy:
+            # The proxy adds the API key, so it isn't in the page
+            tf_tiles = f"{args.tile_proxy}/thunderforest-outdoors/{{z}}/{{x}}/{{y}}.png"
+        else:
+            tf_api_key = os.environ["THUNDERFOREST_API_KEY"]
+            tf_tiles = "https://tile.thunderforest.com/outdoors/{z}/{x}/{y}{r}.png?apikey="
+            tf_tiles += tf_api_key
         tf_attr = (
             '&copy; <a href="http://www.thunderforest.com/">Thunderforest</a>, &copy; '
             '<a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
@@ -277,25 +659,55 @@ def main():
     )
     # Domain-based free account (200k tiles per month),
     # stats here: https://client.stadiamaps.com/dashboard/
+    if args.tile_proxy:
+        st_tiles = f"{args.tile_proxy}/stamen-terrain/{{z}}/{{x}}/{{y}}.jpg"
+    else:
+        st_tiles = "https://tiles.stadiamaps.com/tiles/stamen_terrain/{z}/{x}/{y}{r}.jpg"
     folium.TileLayer(
-        tiles="https://tiles.stadiamaps.com/tiles/stamen_terrain/{z}/{x}/{y}{r}.jpg",
+        tiles=st_tiles,
         attr=st_attr,
         name="Stamen Terrain",
         detect_retina=False,
         show=False,
     ).add_to(the_map)
     folium.TileLayer("OpenStreetMap", detect_retina=True, show=False).add_to(the_map)
+    if args.heatmap:
+        folium.TileLayer(
+            tiles=heatmap_dir + "/{z}/{x}/{y}.png",
+            attr="Strava activities",
+            name="Heatmap",
+            overlay=True,
+            max_native_zoom=args.heatmap_max_zoom,
+            show=True,
+        ).add_to(the_map)
 
     # Create marker cluster for activity markers
-    marker_cluster = MarkerCluster(name="Activity pins").add_to(the_map)
+    if args.cluster_markers:
+        # Clustered by RouteLayer beforehand
+        args.compact_routes = True
+        marker_cluster = folium.FeatureGroup(name="Activity pins").add_to(the_map)
+    else:
+        marker_cluster = MarkerCluster(name="Activity pins").add_to(the_map)
 
     # Create feature group for day labels
     day_labels_fg = folium.FeatureGroup(name="Day labels", show=True)
     the_map.add_child(day_labels_fg)
 
+    fg = None
     if not args.skip_photos:
         fg = folium.FeatureGroup(name="Show Photos", show=False)
         the_map.add_child(fg)
+
+    if args.split_data:
+        args.compact_routes = True
+        manifest_name = f"{os.path.splitext(os.path.basename(output))[0]}-data.json"
+        manifest_path = os.path.join(os.path.dirname(output), manifest_name)
+    if args.compact_routes:
+        route_layer = RouteLayer(
+            marker_cluster, day_labels_fg, photos=fg,
+            data_url=manifest_name if args.split_data else None, cluster=args.cluster_markers,
+        )
+        the_map.add_child(route_layer)
     folium.LayerControl(collapsed=False).add_to(the_map)
     Fullscreen().add_to(the_map)
 
@@ -307,11 +719,12 @@ def main():
     #     popup="Auberge de Jeunesse HI Chamonix",
     # ).add_to(the_map)
 
-    csv_str = "Day,Date,Name,Distance,Ascend,Total Dist.,Strava Link\n"
-    dist_total = 0
     activity_count = 0
+    simplify_stats = {"points": 0, "kept": 0, "bytes": 0, "kept_bytes": 0}
+    overlap_index = dedup.OverlapIndex(args.dedup_routes) if args.dedup_routes else None
+    bounds = None
 
-    # Track longest activity per day for label placement
+    # Track of the longest activity per day for label placement
     longest_per_day = {}
 
     # Color scheme - alternating red and blue by day
@@ -320,31 +733,28 @@ def main():
         1: "#1E88E5",  # Blue for even days (2, 4, 6...)
     }
 
-    for activity in activities:
+    for activity, track, from_stream in zip(activities, tracks, stream_points):
         start_date_local = datetime.fromisoformat(activity["start_date_local"][:10])
 
-        if activity["type"] == "Hike":
-            date = activity["start_date_local"][0:10]
-            name = activity["name"]
-
-            pattern = r"Day (\d+)"
-            match = re.search(pattern, name)
-            if match:
-                day = match.group(1)
-            else:
-                day = "0"
-
-            dist = round(activity["distance"]/1000, 1)
-            ascend = round(activity["total_elevation_gain"])
-            dist_total = round(dist_total + dist, 1)
-            link = f"https://www.strava.com/activities/{activity['id']}"
-            csv_str += f"{day},{date},{name},{dist},{ascend},{dist_total},{link}\n"
-
-        polyline_str = activity["map"]["summary_polyline"]
-
-        if not polyline_str:
+        if not len(track):
             continue
-        points = decode_polyline(activity["map"]["summary_polyline"])
+        if args.simplify and from_stream:
+            # Already simplified when read, counted against the full resolution stream
+            points = streams.route_points(streams.load_stream(activity["id"]), None)
+            simplified = track.points()
+        elif args.simplify:
+            points = track.points()
+            simplified = simplify.simplify(points, args.simplify)
+            track = Track(track.activity_id, simplified, track.distance)
+        if args.simplify:
+            simplify_stats["points"] += len(points)
+            simplify_stats["kept"] += len(simplified)
+            simplify_stats["bytes"] += simplify.encoded_size(points)
+            simplify_stats["kept_bytes"] += simplify.encoded_size(simplified)
+        # Parts of the route to draw, None for all of it
+        pieces = None
+        if overlap_index:
+            pieces = overlap_index.add(track.points())
 
         # Calculate day number relative to first_day date (first_day = day 1)
         day_number = (start_date_local.date() - first_day_date).days + 1
@@ -354,25 +764,11 @@ def main():
         # Get alternating color based on day number
         route_color = colors[(day_number - 1) % 2]
 
-        popup_text = (
-            f"<div style='width: 15em'><b>{activity['name']}</b><br>\n"
-            f"{date_str}<br><br>\n"
-            f"Distance: {round(activity['distance']/1000, 1)} km<br>\n"
-            f"Elevation gain: {round(activity['total_elevation_gain'])} m<br><br>\n"
-            f"<a href='https://www.strava.com/activities/{activity['id']}'>"
-            "View on Strava</a></div>"
-        )
-
-        # Add clickable route with alternating color
-        folium.PolyLine(points, color=route_color, weight=5, popup=popup_text).add_to(the_map)
-
-        # Track longest activity per day for label placement
-        if day_number not in longest_per_day or activity['distance'] > longest_per_day[day_number]['distance']:
-            longest_per_day[day_number] = {
-                'distance': activity['distance'],
-                'points': points,
-                'color': route_color
-            }
+        track.day_number = day_number
+        track.color = route_color
+        if day_number not in longest_per_day or track.distance > longest_per_day[day_number].distance:
+            longest_per_day[day_number] = track
+        bounds = merge_bounds(bounds, track.bounds)
 
         # Determine activity type icon
         activity_type = activity.get('type', 'Other')
@@ -390,39 +786,69 @@ def main():
         # Use alternating icon color to match route
         icon_color = 'red' if (day_number - 1) % 2 == 0 else 'blue'
 
-        # Use starting position for marker with activity type icon
-        marker_loc = points[0]
-        popup = folium.map.Popup(html=popup_text)
-        icon = folium.Icon(icon=icon_name, prefix='fa', color=icon_color)
-        folium.Marker(location=marker_loc, icon=icon, popup=popup).add_to(marker_cluster)
-        activity_count += 1
-        if not args.skip_photos:
-            photos_thumb = get_activity_photos(
-                access_token, activity["id"], size=PHOTO_THUMB_SIZE
+        if args.compact_routes:
+            route_layer.add_route(
+                activity, track, date_str, route_color, icon_name, icon_color,
+                polyline=not args.heatmap, pieces=pieces,
             )
-            photos_large = get_activity_photos(
-                access_token, activity["id"], size=PHOTO_LARGE_SIZE
+        else:
+            popup_text = (
+                f"<div style='width: 15em'><b>{activity['name']}</b><br>\n"
+                f"{date_str}<br><br>\n"
+                f"Distance: {round(activity['distance']/1000, 1)} km<br>\n"
+                f"Elevation gain: {round(activity['total_elevation_gain'])} m<br><br>\n"
+                f"<a href='https://www.strava.com/activities/{activity['id']}'>"
+                "View on Strava</a></div>"
             )
+
+            # Add clickable route with alternating color (unless drawn by the heatmap)
+            if not args.heatmap and (pieces is None or pieces):
+                folium.PolyLine(
+                    track.points() if pieces is None else pieces, color=route_color, weight=5, popup=popup_text
+                ).add_to(the_map)
+
+            # Use starting position for marker with activity type icon
+            marker_loc = track[0]
+            popup = folium.map.Popup(html=popup_text)
+            icon = folium.Icon(icon=icon_name, prefix='fa', color=icon_color)
+            folium.Marker(location=marker_loc, icon=icon, popup=popup).add_to(marker_cluster)
+        activity_count += 1
+        if not args.skip_photos:
+            photos_thumb = photos[(activity["id"], PHOTO_THUMB_SIZE)]
+            photos_large = photos[(activity["id"], PHOTO_LARGE_SIZE)]
             # If we fail to get either thumbs or large photos, just skip the photos
             for photo in range(min(len(photos_thumb), len(photos_large))):
                 if "location" not in photos_thumb[photo]:
                     continue
+                thumb_url = photos_thumb[photo]["urls"][PHOTO_THUMB_SIZE]
+                thumb_url = mirrored.get(thumb_url, thumb_url)
+                large_url = photos_large[photo]["urls"][PHOTO_LARGE_SIZE]
+                large_url = mirrored.get(large_url, large_url)
+                if args.compact_routes:
+                    route_layer.add_photo(
+                        photos_thumb[photo]["location"],
+                        thumb_url,
+                        photos_thumb[photo]["sizes"][PHOTO_THUMB_SIZE],
+                        large_url,
+                    )
+                    continue
                 icon = folium.CustomIcon(
-                    photos_thumb[photo]["urls"][PHOTO_THUMB_SIZE],
+                    thumb_url,
                     icon_size=photos_thumb[photo]["sizes"][PHOTO_THUMB_SIZE],
                 )
-                popup = folium.map.Popup(
-                    html=f"<img src='{photos_large[photo]['urls'][PHOTO_LARGE_SIZE]}'>"
-                )
-                folium.Marker(
-                    location=photos_thumb[photo]["location"], icon=icon, popup=popup
-                ).add_to(the_map).add_to(fg)
+                popup = folium.map.Popup(html=f"<img src='{large_url}'>")
+                location = photos_thumb[photo]["location"]
+                folium.Marker(location=location, icon=icon, popup=popup).add_to(the_map).add_to(fg)
+                bounds = merge_bounds(bounds, [location, location])
 
     # Add "Day X" labels at midpoint of longest activity for each day
-    for day_number, day_data in longest_per_day.items():
-        points = day_data['points']
-        midpoint = points[len(points) // 2]
-        label_color = day_data['color']
+    for day_number, track in longest_per_day.items():
+        midpoint = track.midpoint()
+        label_color = track.color
+
+        if args.compact_routes:
+            route_layer.add_day_label(day_number, midpoint, label_color)
+            continue
 
         day_label = folium.DivIcon(html=f"""
             <div style="
@@ -435,13 +861,53 @@ def main():
         """)
         folium.Marker(location=midpoint, icon=day_label).add_to(day_labels_fg)
 
-    boundary = the_map.get_bounds()
-    the_map.fit_bounds(boundary, padding=(3, 3), max_zoom=13)
-    the_map.save(args.output)
+    stats.end_phase("build map")
+
+    stats.start_phase("save map")
+    if args.split_data:
+        # The page fits bounds itself once data is loaded
+        data_path = route_layer.write_data(manifest_path)
+        make_ids_stable(the_map.get_root())
+        shell = the_map.get_root().render()
+        if os.path.isfile(output):
+            with open(output) as f:
+                shell_changed = f.read() != shell
+        else:
+            shell_changed = True
+        if shell_changed:
+            with open(output, "w") as f:
+                f.write(shell)
+        stats.count("output bytes", os.path.getsize(data_path))
+    else:
+        # Same as the_map.get_bounds(), without going over all map objects
+        boundary = bounds or [[None, None], [None, None]]
+        the_map.fit_bounds(boundary, padding=(3, 3), max_zoom=13)
+        the_map.save(output)
+    stats.end_phase("save map")
+    stats.count("output bytes", os.path.getsize(output))
+    stats.count("activities rendered", activity_count)
     print(f"Total activities: {activity_count}")
-    print(f"Map saved to: {args.output}")
-    with open("hikes.csv", "w") as file:
-        file.write(csv_str)
+    if args.simplify:
+        print(
+            f"Simplified routes: {simplify_stats['points']} -> {simplify_stats['kept']} points, "
+            f"{(simplify_stats['bytes'] - simplify_stats['kept_bytes']) / 1000:.1f} kB saved"
+        )
+    if overlap_index:
+        print(
+            f"Deduplicated routes of {output}: {overlap_index.removed} of {overlap_index.points} "
+            "points removed"
+        )
+        stats.count("points removed by dedup", overlap_index.removed)
+    if args.split_data:
+        print(f"Map data saved to: {data_path} (manifest: {manifest_path})")
+        if shell_changed:
+            print(f"Map page saved to: {output}")
+        else:
+            print(f"Map page unchanged: {output}")
+    else:
+        print(f"Map saved to: {output}")
+    trip_stats.write_hikes_csv(csv_path, activities)
+    return stats
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+"""Instrumentation of map builds
+
+BuildStats collects wall time and number of runs per build phase, arbitrary
+counters (points decoded, output bytes, ...) and the number of API requests
+per endpoint. build_map.py prints a summary at the end of each build and can
+write it as JSON (--stats-json) to track build cost over time.
+"""
+from collections import Counter
+from contextlib import contextmanager
+import json
+import re
+import threading
+import time
+
+# Requests are recorded from several threads (BuildStats itself must stay picklable)
+_lock = threading.Lock()
+
+
+def endpoint_name(path):
+    """Return API path with ids replaced, e.g. /activities/{id}/photos"""
+    return re.sub(r"/\d+", "/{id}", path)
+
+
+class BuildStats:
+    def __init__(self):
+        self.phases = {}
+        self.counters = Counter()
+        self.requests = Counter()
+        self.rate_limit = None
+        self._started = {}
+
+    def start_phase(self, name):
+        self._started[name] = time.perf_counter()
+
+    def end_phase(self, name):
+        phase = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+        phase["seconds"] += time.perf_counter() - self._started.pop(name)
+        phase["calls"] += 1
+
+    @contextmanager
+    def phase(self, name):
+        self.start_phase(name)
+        try:
+            yield
+        finally:
+            self.end_phase(name)
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def record_request(self, path, status_code):
+        with _lock:
+            self.requests[endpoint_name(path)] += 1
+            self.counters[f"responses {status_code}"] += 1
+
+    def record_rate_limit(self, rate_limiter):
+        self.rate_limit = {
+            "limits": list(rate_limiter.limits),
+            "usage": list(rate_limiter.usage),
+        }
+
+    def merge(self, other):
+        """Add stats of another build (e.g. from a worker process)"""
+        for name, phase in other.phases.items():
+            mine = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+            mine["seconds"] += phase["seconds"]
+            mine["calls"] += phase["calls"]
+        self.counters.update(other.counters)
+        self.requests.update(other.requests)
+
+    def to_dict(self):
+        return {
+            "phases": self.phases,
+            "counters": dict(self.counters),
+            "requests": dict(self.requests),
+            "rate_limit": self.rate_limit,
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def print_summary(self):
+        print("Build stats:")
+        for name, phase in self.phases.items():
+            print(f"  {name}: {phase['seconds']:.2f} s ({phase['calls']}x)")
+        for name, value in sorted(self.counters.items()):
+            print(f"  {name}: {value}")
+        for endpoint, count in sorted(self.requests.items()):
+            print(f"  API requests {endpoint}: {count}")
+        if self.rate_limit:
+            usage, limits = self.rate_limit["usage"], self.rate_limit["limits"]
+            print(
+                f"  Rate limit usage: {usage[0]}/{limits[0]} per 15 min, "
+                f"{usage[1]}/{limits[1]} per day"
+            )
+
+
+# Stats of the current build
+STATS = BuildStats()
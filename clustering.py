@@ -0,0 +1,59 @@
+"""Marker clustering precomputed per zoom level
+
+Instead of letting Leaflet.markercluster build and cluster every marker in
+the browser, markers are clustered here once for every zoom level using a
+grid of CLUSTER_RADIUS pixel cells in Web Mercator. Each level is built from
+the one above it (like supercluster does), so clusters nest: a cluster at
+zoom z is made of clusters or markers of zoom z + 1.
+
+The page gets the zoom range and centroid of every cluster (once, not per
+level) and the zoom from which each marker shows up on its own. A full
+marker is only created then, i.e. when its cluster is expanded.
+"""
+from web_mercator import TILE_SIZE, inverse_mercator, mercator
+
+CLUSTER_RADIUS = 60  # pixels
+MAX_ZOOM = 16  # markers are never clustered above this zoom
+
+
+def cluster_hierarchy(locations, max_zoom=MAX_ZOOM, radius=CLUSTER_RADIUS):
+    """Cluster (lat, lng) locations for zoom levels 0..max_zoom
+
+    Returns dict with "zooms", the lowest zoom at which each location is
+    shown on its own (0 if it's never clustered), and "clusters", a list of
+    [lat, lng, count, min_zoom, split_zoom]. A cluster is shown from
+    min_zoom up to split_zoom, where it splits up. Every cluster is listed
+    once, however many zoom levels it spans.
+    """
+    zooms = [0] * len(locations)
+    clusters = []
+    # Items are [x, y, count, id], id is the index of a location or ~index of a cluster
+    items = [[*mercator(lat, lng), 1, index] for index, (lat, lng) in enumerate(locations)]
+    for zoom in range(max_zoom, -1, -1):
+        cell = radius / (TILE_SIZE * 2 ** zoom)
+        cells = {}
+        for item in items:
+            cells.setdefault((int(item[0] / cell), int(item[1] / cell)), []).append(item)
+        items = []
+        for members in cells.values():
+            if len(members) == 1:
+                items.append(members[0])
+                continue
+            count = sum(member[2] for member in members)
+            x = sum(member[0] * member[2] for member in members) / count
+            y = sum(member[1] * member[2] for member in members) / count
+            # Members are shown from the zoom at which this cluster splits up
+            for member in members:
+                if member[3] >= 0:
+                    zooms[member[3]] = zoom + 1
+                else:
+                    clusters[~member[3]][3] = zoom + 1
+            clusters.append([x, y, count, 0, zoom + 1])
+            items.append([x, y, count, ~(len(clusters) - 1)])
+    return {
+        "zooms": zooms,
+        "clusters": [
+            [*(round(value, 5) for value in inverse_mercator(x, y)), count, min_zoom, split_zoom]
+            for x, y, count, min_zoom, split_zoom in clusters
+        ],
+    }
@@ -0,0 +1,101 @@
+"""Removal of route sections that overlap routes already drawn
+
+Out-and-back hikes, walks around the same town and repeated trail sections
+would otherwise be drawn several times on top of each other. OverlapIndex
+hashes routes into a grid of cells (tolerance / 2 meters wide) as they are
+added, oldest first. A point of a new route is covered when its cell was
+reached by an earlier route, or by an earlier part of the same route (more
+than LOOKBACK tolerances back along it, so the return leg of an out-and-back
+is dropped too). Covered sections at least MIN_OVERLAP meters long are cut
+out, the rest of the route is returned as pieces to draw. Requires NumPy.
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, but needed for deduplication
+    np = None
+
+TOLERANCE = 20  # meters
+MIN_OVERLAP = 100  # meters
+LOOKBACK = 5  # tolerances
+EARTH_RADIUS = 6371000  # meters
+
+# Key offsets of a cell and its 8 neighbours, keys are (ix << 32) + iy
+NEIGHBOURS = [(dx << 32) + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+def _runs(mask):
+    """Return start and end (exclusive) indices of runs of True in mask"""
+    changes = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    return changes[::2], changes[1::2]
+
+
+class OverlapIndex:
+    def __init__(self, tolerance=TOLERANCE, min_overlap=MIN_OVERLAP):
+        self.cell = tolerance / 2
+        self.lookback = LOOKBACK * tolerance
+        self.min_overlap = min_overlap
+        self.scale = None
+        self.cells = set()
+        self.points = 0
+        self.removed = 0
+
+    def _project(self, points):
+        if self.scale is None:
+            # Local equirectangular projection around the first route
+            lat0 = math.radians(float(points[0, 0]))
+            self.scale = (EARTH_RADIUS * math.pi / 180, EARTH_RADIUS * math.cos(lat0) * math.pi / 180)
+        return points[:, 1] * self.scale[1], points[:, 0] * self.scale[0]
+
+    def _keys(self, x, y):
+        ix = np.floor(x / self.cell).astype(np.int64)
+        iy = np.floor(y / self.cell).astype(np.int64)
+        return (ix << 32) + iy
+
+    def add(self, points):
+        """Add route, return list of pieces ((N, 2) arrays) not covered by earlier routes
+
+        `points` is an (N, 2) lat/lng array. All of the route is added to the
+        index, including the covered parts.
+        """
+        points = np.asarray(points, dtype=float)
+        self.points += len(points)
+        if len(points) < 2:
+            return [points] if len(points) else []
+        x, y = self._project(points)
+        lengths = np.hypot(np.diff(x), np.diff(y))
+        along = np.concatenate(([0], np.cumsum(lengths)))
+
+        # Sample segments every half cell, so every cell they pass is reached
+        steps = np.maximum(np.ceil(lengths / (self.cell / 2)).astype(np.int64), 1)
+        segment = np.repeat(np.arange(len(lengths)), steps)
+        fraction = (np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[segment]
+        sx = np.append(x[segment] + np.diff(x)[segment] * fraction, x[-1])
+        sy = np.append(y[segment] + np.diff(y)[segment] * fraction, y[-1])
+        sample_along = np.append(along[segment] + lengths[segment] * fraction, along[-1])
+        reached = np.concatenate([self._keys(sx, sy) + offset for offset in NEIGHBOURS])
+        reached_along = np.tile(sample_along, len(NEIGHBOURS))
+
+        keys = self._keys(x, y)
+        covered = np.fromiter(map(self.cells.__contains__, keys.tolist()), dtype=bool, count=len(keys))
+        # Where along the route itself each cell was reached first: sort by cell,
+        # then by distance along the route, so the first of each cell is the earliest
+        order = np.lexsort((reached_along, reached))
+        first_keys, first = np.unique(reached[order], return_index=True)
+        first_along = reached_along[order][first]
+        index = np.minimum(np.searchsorted(first_keys, keys), len(first_keys) - 1)
+        covered |= (first_keys[index] == keys) & (first_along[index] < along - self.lookback)
+        self.cells.update(first_keys.tolist())
+
+        # Only cut out overlaps long enough to matter
+        starts, ends = _runs(covered)
+        long_runs = along[ends - 1] - along[starts] >= self.min_overlap
+        starts, ends = starts[long_runs], ends[long_runs]
+        # Pieces go from the last point of one overlap to the first of the next
+        piece_starts = np.concatenate(([0], ends - 1))
+        piece_ends = np.concatenate((starts, [len(points) - 1]))
+        pieces = [points[start:end + 1] for start, end in zip(piece_starts, piece_ends) if end > start]
+        kept = sum(len(piece) for piece in pieces)
+        self.removed += len(points) - kept
+        return pieces
@@ -0,0 +1,49 @@
+"""Fingerprint of everything a map build depends on
+
+The fingerprint is a hash of the activities (only fields that end up on the
+map, so e.g. new kudos don't count as a change), their photos, the build
+settings (date range, first day, rendering options) and the source of the
+rendering code. When it's the same as for the last successful build, the
+output would be identical and building it again can be skipped.
+"""
+import hashlib
+import json
+import os
+
+# Activity fields used for rendering
+ACTIVITY_FIELDS = (
+    "id", "name", "type", "start_date_local", "distance", "total_elevation_gain",
+    "total_photo_count",
+)
+
+# Modules whose changes change the output
+RENDER_SOURCES = (
+    "build_map.py", "route_layer.py", "polyline.py", "simplify.py", "track.py", "clustering.py",
+    "heatmap.py", "photo_mirror.py", "trip_stats.py", "streams.py",
+    "dedup.py", "web_mercator.py",
+)
+
+
+def activity_key(activity):
+    key = {field: activity.get(field) for field in ACTIVITY_FIELDS}
+    key["polyline"] = activity["map"]["summary_polyline"]
+    return key
+
+
+def input_fingerprint(activities, photos, settings):
+    """Return hex digest of the build inputs
+
+    `photos` is the {(activity_id, size): photos} dict of fetch_photos(),
+    `settings` a JSON serializable dict of everything else affecting the output.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    for activity in sorted(activities, key=lambda activity: activity["id"]):
+        digest.update(json.dumps(activity_key(activity), sort_keys=True).encode())
+    for key in sorted(photos):
+        digest.update(json.dumps([key, photos[key]], sort_keys=True).encode())
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in RENDER_SOURCES:
+        with open(os.path.join(source_dir, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
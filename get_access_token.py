@@ -11,9 +11,14 @@ for 6 hours).
 The script automatically reuses existing data if present:
 1. Login cookie is saved to COOKIES_FILE so that subsequent runs of the script
    don't need to login again.
-2. refresh_token is saved to TOKEN_JSON so that on subsequent runs we try
-   to use that to get a new token directly and if it works, Strava
-   login and authorization are skipped
+2. The token is saved to TOKEN_JSON. While its access_token is still valid
+   for more than TOKEN_EXPIRY_MARGIN seconds, it's used as is. Otherwise we
+   try to use refresh_token to get a new token directly and if it works,
+   Strava login and authorization are skipped
+
+TOKEN_JSON is locked while the token is being read or refreshed, so several
+builds running at once don't refresh it at the same time. mechanize (only
+needed for the login) is imported only when the login is actually needed.
 
 Required env vars (either already set, or via .env file):
 STRAVA_EMAIL
@@ -21,19 +26,65 @@ STRAVA_PASSWORD
 STRAVA_API_CLIENT_ID
 STRAVA_API_CLIENT_SECRET
 """
+from contextlib import contextmanager
 import os
+import time
 import urllib.parse
 import requests
 import json
 
-import mechanize
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, no locking there
+    fcntl = None
+
 
 COOKIES_FILE = "cookies.txt"
 TOKEN_JSON = "token.json"
+TOKEN_LOCK = TOKEN_JSON + ".lock"
+# Refresh the access token if it expires in less than this many seconds
+TOKEN_EXPIRY_MARGIN = 10 * 60
 STRAVA_API_URL = "https://www.strava.com/api/v3"
 
+# Shared keep-alive session for all requests to the OAuth endpoints
+SESSION = requests.Session()
+
+
+@contextmanager
+def token_lock():
+    """Hold an exclusive lock on the token for the duration of the block"""
+    if fcntl is None:
+        yield
+        return
+    with open(TOKEN_LOCK, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def save_token(values):
+    """Atomically replace TOKEN_JSON"""
+    tmp_file = f"{TOKEN_JSON}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(values, f)
+    os.replace(tmp_file, TOKEN_JSON)
+
+
+def load_valid_token():
+    """Return access_token from TOKEN_JSON if it's not about to expire, else None"""
+    if not os.path.isfile(TOKEN_JSON):
+        return None
+    with open(TOKEN_JSON, "r") as f:
+        token = json.load(f)
+    if token.get("expires_at", 0) - time.time() < TOKEN_EXPIRY_MARGIN:
+        return None
+    print(f"Using access token from {TOKEN_JSON}")
+    return token["access_token"]
+
 
 def load_and_refresh_token():
     """Load token from TOKEN_JSON and refresh it
@@ -52,13 +103,12 @@ def load_and_refresh_token():
             "refresh_token": token["refresh_token"]
         }
         print("Refreshing token")
-        response = requests.post("https://www.strava.com/oauth/token", data=data)
+        response = SESSION.post("https://www.strava.com/oauth/token", data=data)
         if not response.ok:
             print(f"Could not refresh token: {response.status_code} {response.reason}")
             return None
         values = response.json()
-        with open(TOKEN_JSON, "w") as f:
-            json.dump(values, f)
+        save_token(values)
         print("Successfully loaded and refreshed token")
         return values["access_token"]
     # STRAVA_REFRESH_TOKEN set in env
@@ -70,19 +120,20 @@ def load_and_refresh_token():
             "grant_type": "refresh_token",
             "refresh_token": os.environ["STRAVA_REFRESH_TOKEN"]
         }
-        response = requests.post("https://www.strava.com/oauth/token", data=data)
+        response = SESSION.post("https://www.strava.com/oauth/token", data=data)
         if not response.ok:
             print(f"Could not refresh token: {response.status_code} {response.reason}")
             return None
         values = response.json()
-        with open(TOKEN_JSON, "w") as f:
-            json.dump(values, f)
+        save_token(values)
         print("Successfully loaded and refreshed token from env")
         return values["access_token"]
     return None
 
 
 def authorize_and_get_token():
+    import mechanize  # Slow to import and rarely needed
+
     br = mechanize.Browser()
     cj = load_cookiejar()
     br.set_cookiejar(cj)
@@ -104,7 +155,7 @@ def authorize_and_get_token():
     # Simply using br.submit() would be best, but it follows the redirect
     # which is not desired. This is a workaround for that.
     request = br.click()
-    response = requests.post(
+    response = SESSION.post(
         request.full_url,
         data=request.data,
         cookies=cj,
@@ -121,15 +172,16 @@ def authorize_and_get_token():
         "code": code,
         "grant_type": "authorization_code"
     }
-    response = requests.post("https://www.strava.com/oauth/token", data=data)
+    response = SESSION.post("https://www.strava.com/oauth/token", data=data)
     values = response.json()
-    with open(TOKEN_JSON, "w") as f:
-        json.dump(values, f)
+    save_token(values)
     print("Successfully got token")
     return values["access_token"]
 
 
 def load_cookiejar():
+    import mechanize
+
     cj = mechanize.LWPCookieJar(COOKIES_FILE)
     if os.path.exists(COOKIES_FILE):
         print(f"Loading cookie from {COOKIES_FILE}")
@@ -149,11 +201,14 @@ def login(br, cj):
 def get_access_token():
     load_dotenv()  # Load env vars from .env for development
 
-    # First try to get the token from $TOKEN_JSON
-    access_token = load_and_refresh_token()
-    # If that didn't work, login to Strava, authorize the app and get new token
-    if access_token is None:
-        access_token = authorize_and_get_token()
+    with token_lock():
+        # First try the still valid token or refresh it from $TOKEN_JSON
+        access_token = load_valid_token()
+        if access_token is None:
+            access_token = load_and_refresh_token()
+        # If that didn't work, login to Strava, authorize the app and get new token
+        if access_token is None:
+            access_token = authorize_and_get_token()
 
     return access_token
 
@@ -0,0 +1,150 @@
+"""Heatmap of routes rendered to an XYZ tile pyramid
+
+All decoded routes are rasterized into 256x256 PNG tiles for zoom levels
+0..max_zoom, which the map shows as a TileLayer. However many activities
+there are, the page only loads the few tiles in view.
+
+Route segments are sampled at pixel spacing and the samples binned per
+tile and pixel with NumPy, all zoom levels are rendered in parallel. The
+color of a pixel shows how many samples fell into it (log scaled per zoom
+level), so frequently used trails stand out. PNGs are written with zlib,
+no imaging library is needed. Requires NumPy.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+import struct
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, but needed for heatmaps
+    np = None
+
+from web_mercator import MAX_LATITUDE, TILE_SIZE
+
+TILE_PIXELS = TILE_SIZE * TILE_SIZE
+MAX_ZOOM = 13
+
+# Color ramp from few to many passes: (position, (r, g, b, alpha))
+COLOR_STOPS = (
+    (0.0, (40, 90, 255, 140)),
+    (0.5, (230, 30, 120, 200)),
+    (1.0, (255, 220, 0, 255)),
+)
+
+# Offsets making lines 3 pixels wide
+PEN = ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1))
+
+
+def mercator(coordinates):
+    """Return normalized Web Mercator x, y arrays (0..1) of (N, 2) lat/lng array"""
+    lat = np.radians(np.clip(coordinates[:, 0], -MAX_LATITUDE, MAX_LATITUDE))
+    x = (coordinates[:, 1] + 180) / 360
+    y = 0.5 - np.log(np.tan(np.pi / 4 + lat / 2)) / (2 * np.pi)
+    return x, y
+
+
+def sample_routes(x, y, offsets, zoom):
+    """Return integer global pixel coordinates of points along all routes
+
+    Segments are sampled about every pixel, segments between the end of one
+    route and the start of the next one are left out.
+    """
+    scale = TILE_SIZE * 2 ** zoom
+    px, py = x * scale, y * scale
+    # Segment i goes from point i to i + 1, drop those crossing route boundaries
+    starts = np.ones(len(px), dtype=bool)
+    starts[offsets[1:-1] - 1] = False
+    starts[-1] = False
+    segments = np.flatnonzero(starts)
+    dx, dy = px[segments + 1] - px[segments], py[segments + 1] - py[segments]
+    steps = np.maximum(np.ceil(np.hypot(dx, dy)).astype(np.int64), 1)
+    index = np.repeat(np.arange(len(segments)), steps)
+    fraction = (np.arange(len(index)) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[index]
+    sx = px[segments][index] + dx[index] * fraction
+    sy = py[segments][index] + dy[index] * fraction
+    # Route ends (and routes of a single point)
+    ends = np.flatnonzero(~starts)
+    sx, sy = np.concatenate((sx, px[ends])), np.concatenate((sy, py[ends]))
+    return sx.astype(np.int64), sy.astype(np.int64)
+
+
+def palette(max_count):
+    """Return RGBA uint8 lookup table (max_count + 1, 4) from pixel count to color"""
+    counts = np.arange(max_count + 1)
+    value = np.log1p(counts) / np.log1p(max(max_count, 1))
+    positions = [stop[0] for stop in COLOR_STOPS]
+    lut = np.zeros((max_count + 1, 4), dtype=np.uint8)
+    for channel in range(4):
+        lut[:, channel] = np.interp(value, positions, [stop[1][channel] for stop in COLOR_STOPS])
+    lut[0] = 0  # Transparent where there are no routes
+    return lut
+
+
+def write_png(path, image):
+    """Write RGBA uint8 image as PNG"""
+    height, width = image.shape[:2]
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    # Filter type 0 (none) in front of every row
+    rows = np.concatenate((np.zeros((height, 1), dtype=np.uint8), image.reshape(height, -1)), axis=1)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+def render_zoom(x, y, offsets, zoom, directory):
+    """Render all tiles with routes for one zoom level, returns number of tiles"""
+    sx, sy = sample_routes(x, y, offsets, zoom)
+    size = TILE_SIZE * 2 ** zoom
+    # Count samples per pixel sparsely, keys are tile * TILE_PIXELS + pixel (so sorted by tile)
+    keys = np.empty(len(sx) * len(PEN), dtype=np.int64)
+    for i, (ox, oy) in enumerate(PEN):
+        px, py = (sx + ox) % size, np.clip(sy + oy, 0, size - 1)
+        tiles = (px // TILE_SIZE) * 2 ** zoom + py // TILE_SIZE
+        keys[i * len(sx):(i + 1) * len(sx)] = tiles * TILE_PIXELS + (py % TILE_SIZE) * TILE_SIZE + px % TILE_SIZE
+    del sx, sy, px, py, tiles
+    # Same as np.unique(keys, return_counts=True), without a sorted copy
+    keys.sort()
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = np.diff(np.append(starts, len(keys)))
+    keys = keys[starts]
+    lut = palette(int(counts.max()))
+    tiles, first = np.unique(keys // TILE_PIXELS, return_index=True)
+    # One tile image at a time
+    for key, start, end in zip(tiles, first, np.append(first[1:], len(keys))):
+        image = np.zeros((TILE_PIXELS, 4), dtype=np.uint8)
+        image[keys[start:end] % TILE_PIXELS] = lut[counts[start:end]]
+        tile_x, tile_y = divmod(int(key), 2 ** zoom)
+        tile_dir = os.path.join(directory, str(zoom), str(tile_x))
+        os.makedirs(tile_dir, exist_ok=True)
+        write_png(os.path.join(tile_dir, f"{tile_y}.png"), image.reshape(TILE_SIZE, TILE_SIZE, 4))
+    return len(tiles)
+
+
+def render_tiles(coordinates, offsets, directory, max_zoom=MAX_ZOOM, max_workers=None):
+    """Render heatmap tiles of routes to directory/{z}/{x}/{y}.png
+
+    `coordinates` and `offsets` are as returned by polyline.decode_polylines().
+    Tiles of a previous build in `directory` are removed. Returns the number
+    of tiles written.
+    """
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    coordinates = np.asarray(coordinates, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if not len(coordinates):
+        return 0
+    x, y = mercator(coordinates)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Highest zoom levels have the most tiles, start with them
+        counts = executor.map(
+            render_zoom, *zip(*((x, y, offsets, zoom, directory) for zoom in range(max_zoom, -1, -1)))
+        )
+        return sum(counts)
@@ -0,0 +1,131 @@
+"""Local mirror of activity photos
+
+Photos are downloaded once from Strava's CDN into PHOTO_CACHE and served
+from there afterwards. The cache is kept under PHOTO_CACHE_SIZE bytes by
+removing the least recently used files (a file's modification time is
+bumped whenever a build uses it).
+
+build_map.py --mirror-photos inlines the thumbnails into the map as data URIs
+and copies the large photos next to the map (see publish()), so showing the
+photo layer doesn't make the browser fetch one remote image per marker.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import hashlib
+import mimetypes
+import os
+import shutil
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PHOTO_CACHE = os.path.join("data", "photos")
+PHOTO_CACHE_SIZE = 500 * 1024 * 1024  # bytes
+DOWNLOAD_WORKERS = 8
+
+
+def cache_name(url):
+    """Return file name of the photo at `url` in the cache"""
+    ext = os.path.splitext(urlparse(url).path)[1] or ".jpg"
+    return hashlib.sha256(url.encode()).hexdigest()[:20] + ext
+
+
+def data_uri(path):
+    content_type = mimetypes.guess_type(path)[0] or "image/jpeg"
+    with open(path, "rb") as f:
+        return f"data:{content_type};base64,{base64.b64encode(f.read()).decode()}"
+
+
+def publish(paths, directory):
+    """Copy photos to `directory` (e.g. next to the map), return {path: file name}
+
+    Files in `directory` not among `paths` (left from previous builds) are removed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    names = {path: os.path.basename(path) for path in paths}
+    for name in os.listdir(directory):
+        if name not in names.values():
+            os.remove(os.path.join(directory, name))
+    for path, name in names.items():
+        target = os.path.join(directory, name)
+        if not os.path.isfile(target):
+            shutil.copyfile(path, target)
+    return names
+
+
+class PhotoMirror:
+    def __init__(self, cache_dir=PHOTO_CACHE, max_bytes=PHOTO_CACHE_SIZE,
+                 max_workers=DOWNLOAD_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.downloaded = 0
+
+    def path(self, url):
+        """Return path of the photo at `url` in the cache"""
+        return os.path.join(self.cache_dir, cache_name(url))
+
+    def _download(self, session, url, path):
+        try:
+            response = session.get(url, timeout=30)
+        except requests.RequestException as e:
+            print(f"Failed to download photo {url}: {e}")
+            return None
+        if response.status_code != requests.codes.ok:
+            print(f"Failed to download photo {url}: {response.status_code}")
+            return None
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(response.content)
+        os.replace(tmp_file, path)
+        return path
+
+    def fetch(self, urls):
+        """Return {url: local path} for all urls, None for photos that failed to download
+
+        Cached photos are marked as used, missing ones are downloaded concurrently.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        paths = {}
+        missing = []
+        for url in set(urls):
+            path = self.path(url)
+            if os.path.isfile(path):
+                os.utime(path)
+                paths[url] = path
+            else:
+                missing.append((url, path))
+        if missing:
+            print(f"Downloading photos: {len(missing)}")
+            with requests.Session() as session:
+                adapter = HTTPAdapter(pool_maxsize=self.max_workers)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    results = executor.map(lambda item: self._download(session, *item), missing)
+                    for (url, _), path in zip(missing, results):
+                        paths[url] = path
+                        self.downloaded += path is not None
+        return paths
+
+    def evict(self, keep=()):
+        """Remove least recently used photos until the cache fits into max_bytes
+
+        Photos in `keep` (e.g. those used by the current build) are never removed.
+        """
+        keep = {os.path.abspath(path) for path in keep if path}
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            # Downloads in progress (by other builds) are left alone
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            os.remove(path)
+            total -= size
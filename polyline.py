@@ -0,0 +1,128 @@
+"""Decoding and encoding of Google encoded polylines (Strava's summary_polyline)
+
+decode_polyline() decodes a single polyline into a list of (lat, lng) tuples,
+encode_polyline() does the opposite.
+decode_polylines() decodes many polylines at once. When NumPy is available it
+does so in a vectorized way and returns one contiguous (N, 2) coordinate array
+plus offsets, otherwise it falls back to decode_polyline() and plain lists.
+"""
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+
+def decode_polyline(polyline_str):
+    """
+    Copied from https://stackoverflow.com/a/33557576
+    """
+    index, lat, lng = 0, 0, 0
+    coordinates = []
+    changes = {"latitude": 0, "longitude": 0}
+
+    # Coordinates have variable length when encoded, so just keep
+    # track of whether we've hit the end of the string. In each
+    # while loop iteration, a single coordinate is decoded.
+    while index < len(polyline_str):
+        # Gather lat/lon changes, store them in a dictionary to apply them later
+        for unit in ["latitude", "longitude"]:
+            shift, result = 0, 0
+
+            while True:
+                byte = ord(polyline_str[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if not byte >= 0x20:
+                    break
+
+            if result & 1:
+                changes[unit] = ~(result >> 1)
+            else:
+                changes[unit] = result >> 1
+
+        lat += changes["latitude"]
+        lng += changes["longitude"]
+
+        coordinates.append((lat / 100000.0, lng / 100000.0))
+
+    return coordinates
+
+
+def decode_polylines(polyline_strs):
+    """Decode many polylines at once
+
+    Returns (coordinates, offsets): points of polyline i are
+    coordinates[offsets[i]:offsets[i + 1]]. With NumPy, coordinates is a (N, 2)
+    float array and offsets an int array, otherwise both are lists.
+    The decoded values are exactly the same as from decode_polyline().
+    """
+    polyline_strs = list(polyline_strs)
+    if np is None:
+        return _decode_polylines_python(polyline_strs)
+    return _decode_polylines_numpy(polyline_strs)
+
+
+def split_polylines(coordinates, offsets):
+    """Return list of per-polyline coordinates from decode_polylines() output"""
+    return [coordinates[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def _decode_polylines_python(polyline_strs):
+    coordinates = []
+    offsets = [0]
+    for polyline_str in polyline_strs:
+        coordinates.extend(decode_polyline(polyline_str))
+        offsets.append(len(coordinates))
+    return coordinates, offsets
+
+
+def _decode_polylines_numpy(polyline_strs):
+    lengths = np.fromiter((len(s) for s in polyline_strs), dtype=np.int64,
+                          count=len(polyline_strs))
+    char_offsets = np.concatenate(([0], np.cumsum(lengths)))
+    data = np.frombuffer("".join(polyline_strs).encode("ascii"), dtype=np.uint8)
+    if not data.size:
+        return np.empty((0, 2)), np.zeros(len(polyline_strs) + 1, dtype=np.int64)
+    data = data.astype(np.int64) - 63
+
+    # Each value is a little-endian varint of 5-bit chunks, the last chunk
+    # of a value has the 0x20 continuation bit cleared.
+    is_last = data < 0x20
+    starts = np.flatnonzero(np.concatenate(([True], is_last[:-1])))
+    value_lengths = np.diff(np.append(starts, data.size))
+    position = np.arange(data.size) - np.repeat(starts, value_lengths)
+    values = np.add.reduceat((data & 0x1F) << (5 * position), starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1).reshape(-1, 2)
+
+    # Number of values (2 per point) preceding each polyline
+    values_before = np.concatenate(([0], np.cumsum(is_last)))[char_offsets]
+    offsets = values_before // 2
+
+    # Cumulative sum over all points, then rebase each polyline to start from 0
+    totals = np.cumsum(deltas, axis=0)
+    base = np.concatenate((np.zeros((1, 2), dtype=np.int64), totals))[offsets[:-1]]
+    totals -= np.repeat(base, np.diff(offsets), axis=0)
+    return totals / 100000.0, offsets
+
+
+def _encode_value(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def encode_polyline(points):
+    """Encode (lat, lng) points, inverse of decode_polyline()"""
+    chunks = []
+    prev_lat, prev_lng = 0, 0
+    for lat, lng in points:
+        lat, lng = round(lat * 100000), round(lng * 100000)
+        chunks.append(_encode_value(lat - prev_lat))
+        chunks.append(_encode_value(lng - prev_lng))
+        prev_lat, prev_lng = lat, lng
+    return "".join(chunks)
@@ -0,0 +1,169 @@
+"""Rate limit aware scheduling of Strava API requests
+
+Strava limits API usage per 15 minutes and per day. Every response carries the
+current state in headers, e.g.:
+
+    X-RateLimit-Limit: 100,1000
+    X-RateLimit-Usage: 12,345
+
+(first value is the 15-minute window, second the daily one). Newer apps also
+get X-ReadRateLimit-* headers with a stricter limit for read requests, the
+stricter of the two is used. The 15-minute windows start at :00, :15, :30 and
+:45, the daily window resets at midnight UTC.
+
+RateLimiter.request() is used for every Strava call. It keeps track of the
+budget, makes low priority requests (photos) wait for high priority ones
+(activity listing) and leaves a reserve of requests for high priority work.
+When the budget runs out it pauses until the window resets, or raises
+RateLimitExceeded if that would take longer than max_wait seconds.
+"""
+import threading
+import time
+
+import requests
+
+WINDOW_15_MIN = 15 * 60
+WINDOW_DAY = 24 * 60 * 60
+
+# Defaults for apps that haven't seen any response yet
+DEFAULT_LIMITS = (100, 1000)
+
+HIGH = 0  # e.g. activity listing
+LOW = 1  # e.g. photos
+
+# Requests kept aside for high priority work in each window
+LOW_PRIORITY_RESERVE = 10
+
+MAX_WAIT = 15 * 60
+
+
+class RateLimitExceeded(Exception):
+    """Raised when the API budget is used up and waiting would take too long"""
+
+
+def parse_rate_limit_headers(headers):
+    """Return (limits, usage) tuples for (15 min, daily) windows, None if missing"""
+    candidates = []
+    for prefix in ("X-RateLimit", "X-ReadRateLimit"):
+        limit = headers.get(f"{prefix}-Limit")
+        usage = headers.get(f"{prefix}-Usage")
+        if not limit or not usage:
+            continue
+        try:
+            pairs = list(zip(
+                (int(value) for value in limit.split(",")),
+                (int(value) for value in usage.split(",")),
+            ))
+        except ValueError:
+            continue
+        if len(pairs) == 2:
+            candidates.append(pairs)
+    if not candidates:
+        return None
+    # For each window keep whichever limit leaves less remaining
+    windows = [min(pairs, key=lambda pair: pair[0] - pair[1]) for pairs in zip(*candidates)]
+    return tuple(limit for limit, _ in windows), tuple(usage for _, usage in windows)
+
+
+def window_reset(now, window):
+    """Return timestamp at which the current window (WINDOW_15_MIN/WINDOW_DAY) ends"""
+    return (now // window + 1) * window
+
+
+class RateLimiter:
+    def __init__(self, max_wait=MAX_WAIT, reserve=LOW_PRIORITY_RESERVE,
+                 clock=time.time, sleep=time.sleep):
+        self.max_wait = max_wait
+        self.reserve = reserve
+        self.clock = clock
+        self.sleep = sleep
+        self.limits = list(DEFAULT_LIMITS)
+        self.usage = [0, 0]
+        self._resets = [window_reset(clock(), WINDOW_15_MIN), window_reset(clock(), WINDOW_DAY)]
+        self._high_waiting = 0
+        self._condition = threading.Condition()
+
+    def _roll_windows(self, now):
+        for i, window in enumerate((WINDOW_15_MIN, WINDOW_DAY)):
+            if now >= self._resets[i]:
+                self.usage[i] = 0
+                self._resets[i] = window_reset(now, window)
+
+    def remaining(self):
+        with self._condition:
+            self._roll_windows(self.clock())
+            return min(limit - usage for limit, usage in zip(self.limits, self.usage))
+
+    def _wait_time(self, priority, now):
+        """Return seconds to wait before a request of given priority may be sent"""
+        reserve = self.reserve if priority == LOW else 0
+        wait = 0
+        for i in range(2):
+            if self.limits[i] - self.usage[i] <= reserve:
+                wait = max(wait, self._resets[i] - now)
+        return wait
+
+    def acquire(self, priority=HIGH):
+        """Block until a request can be sent, then count it against the budget"""
+        with self._condition:
+            if priority == HIGH:
+                self._high_waiting += 1
+            try:
+                while True:
+                    now = self.clock()
+                    self._roll_windows(now)
+                    if priority == LOW and self._high_waiting:
+                        self._condition.wait()
+                        continue
+                    wait = self._wait_time(priority, now)
+                    if wait <= 0:
+                        break
+                    if wait > self.max_wait:
+                        raise RateLimitExceeded(
+                            f"Strava API budget used up ({self.usage[0]}/{self.limits[0]} per "
+                            f"15 min, {self.usage[1]}/{self.limits[1]} per day), "
+                            f"next window in {round(wait)} s"
+                        )
+                    print(f"Rate limit reached, pausing for {round(wait)} s")
+                    self._condition.release()
+                    try:
+                        self.sleep(wait)
+                    finally:
+                        self._condition.acquire()
+                self.usage[0] += 1
+                self.usage[1] += 1
+            finally:
+                if priority == HIGH:
+                    self._high_waiting -= 1
+                    self._condition.notify_all()
+
+    def update(self, headers):
+        """Update budget from response headers"""
+        parsed = parse_rate_limit_headers(headers)
+        if parsed is None:
+            return
+        with self._condition:
+            self._roll_windows(self.clock())
+            self.limits = list(parsed[0])
+            # Requests of ours still in flight may not be counted yet
+            self.usage = [max(old, new) for old, new in zip(self.usage, parsed[1])]
+            self._condition.notify_all()
+
+    def exhaust(self):
+        """Mark the 15-minute window as used up (after a 429 response)"""
+        with self._condition:
+            self.usage[0] = max(self.usage[0], self.limits[0])
+
+    def request(self, session, method, url, priority=HIGH, **kwargs):
+        """Send request through `session` (or the requests module) within the budget
+
+        Requests rejected with 429 Too Many Requests are retried once the
+        window resets (or RateLimitExceeded is raised).
+        """
+        while True:
+            self.acquire(priority)
+            response = (session or requests).request(method, url, **kwargs)
+            self.update(response.headers)
+            if response.status_code != requests.codes.too_many_requests:
+                return response
+            self.exhaust()
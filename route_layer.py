@@ -0,0 +1,332 @@
+"""Compact data-driven layer with all routes of the map
+
+Instead of one folium PolyLine, Marker and Popup per activity (each of which
+ends up as a separate block of JavaScript in the page), RouteLayer puts all
+routes into a single JSON payload with encoded polylines and a few
+properties per activity. A small script decodes and styles it in the browser,
+creating the same routes, activity pins (in the given marker cluster), popups,
+photo markers and day labels as the folium objects would.
+
+The data can also be written to a separate content-hashed JSON file, which
+the page fetches. The page itself then stays the same between builds (see
+make_ids_stable()), only the small data file changes.
+
+With `cluster` set, activity pins and photos are clustered per zoom level
+beforehand (see clustering.py). The page then only shows the clusters of the
+current zoom level in view and creates a full marker when it's on its own,
+instead of handing every marker to Leaflet.markercluster.
+"""
+import glob
+import hashlib
+import json
+import os
+
+from branca.element import Element, MacroElement
+from jinja2 import Template
+
+from clustering import cluster_hierarchy
+from polyline import encode_polyline
+from track import merge_bounds
+
+
+class RouteLayer(MacroElement):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var markers = {{ this.marker_cluster.get_name() }};
+            var dayLabels = {{ this.day_labels.get_name() }};
+            {%- if this.photos %}
+            var photos = {{ this.photos.get_name() }};
+            {%- endif %}
+
+            function decode(str) {
+                var points = [], index = 0, lat = 0, lng = 0;
+                while (index < str.length) {
+                    var values = [0, 0];
+                    for (var i = 0; i < 2; i++) {
+                        var result = 0, shift = 0, b;
+                        do {
+                            b = str.charCodeAt(index++) - 63;
+                            result |= (b & 0x1f) << shift;
+                            shift += 5;
+                        } while (b >= 0x20);
+                        values[i] = (result & 1) ? ~(result >> 1) : (result >> 1);
+                    }
+                    lat += values[0];
+                    lng += values[1];
+                    points.push([lat / 1e5, lng / 1e5]);
+                }
+                return points;
+            }
+
+            function escape(text) {
+                var div = document.createElement("div");
+                div.textContent = text;
+                return div.innerHTML;
+            }
+
+            function routePopup(route) {
+                var link = "https://www.strava.com/activities/" + route.id;
+                return "<div style='width: 15em'><b>" + escape(route.name) + "</b><br>"
+                    + route.date + "<br><br>"
+                    + "Distance: " + route.distance + " km<br>"
+                    + "Elevation gain: " + route.elevation + " m<br><br>"
+                    + "<a href='" + link + "'>View on Strava</a></div>";
+            }
+
+            function pinMarker(route, location) {
+                var icon = L.AwesomeMarkers.icon({
+                    markerColor: route.icon_color,
+                    iconColor: "white",
+                    icon: route.icon,
+                    prefix: "fa",
+                    extraClasses: "fa-rotate-0"
+                });
+                return L.marker(location, {icon: icon})
+                    .bindPopup(routePopup(route), {maxWidth: "100%"});
+            }
+
+            function photoMarker(photo) {
+                var icon = L.icon({iconUrl: photo.thumb, iconSize: photo.thumb_size});
+                return L.marker(photo.location, {icon: icon})
+                    .bindPopup("<img src='" + photo.large + "'>", {maxWidth: "100%"});
+            }
+            {%- if this.cluster %}
+
+            function clusterIcon(count) {
+                var size = count < 10 ? 30 : count < 100 ? 36 : 42;
+                var color = count < 10 ? "181, 226, 140" : count < 100 ? "241, 211, 87" : "253, 156, 115";
+                var html = "<div style='width: " + size + "px; height: " + size + "px; "
+                    + "line-height: " + size + "px; border-radius: 50%; text-align: center; "
+                    + "font: 12px sans-serif; background: rgba(" + color + ", 0.8); "
+                    + "box-shadow: 0 0 0 5px rgba(" + color + ", 0.4);'>" + count + "</div>";
+                return L.divIcon({html: html, className: "empty", iconSize: [size, size]});
+            }
+
+            // Show clusters and markers on their own of the current zoom level in
+            // view (see cluster_hierarchy()), markers at `locations` are created by
+            // createMarker(index) the first time they show up. Only those whose
+            // visibility changed are added or removed, removing a marker would
+            // close its popup (e.g. right after opening it panned the map).
+            function showClusters(hierarchy, locations, layer, createMarker) {
+                var markers = {}, clusters = {};
+                function show(marker, visible) {
+                    if (visible && !layer.hasLayer(marker)) {
+                        layer.addLayer(marker);
+                    } else if (!visible && layer.hasLayer(marker)) {
+                        layer.removeLayer(marker);
+                    }
+                }
+                function update() {
+                    var zoom = Math.max(0, Math.floor(map.getZoom()));
+                    var bounds = map.getBounds().pad(0.5);
+                    hierarchy.zooms.forEach(function(minZoom, index) {
+                        var visible = minZoom <= zoom && bounds.contains(locations[index]);
+                        if (visible && !markers[index]) {
+                            markers[index] = createMarker(index);
+                        }
+                        if (markers[index]) {
+                            show(markers[index], visible);
+                        }
+                    });
+                    hierarchy.clusters.forEach(function(cluster, index) {
+                        var location = L.latLng(cluster[0], cluster[1]);
+                        var visible = cluster[3] <= zoom && zoom < cluster[4] && bounds.contains(location);
+                        if (visible && !clusters[index]) {
+                            clusters[index] = L.marker(location, {icon: clusterIcon(cluster[2])})
+                                .on("click", function() { map.setView(location, cluster[4]); });
+                        }
+                        if (clusters[index]) {
+                            show(clusters[index], visible);
+                        }
+                    });
+                }
+                map.on("moveend", update);
+                update();
+            }
+            {%- endif %}
+
+            function draw(data) {
+                var starts = [];
+                data.routes.forEach(function(route) {
+                    // A deduplicated route has several polylines (or none) and its start
+                    var pieces = route.polyline ? [].concat(route.polyline).map(decode) : [];
+                    var start = route.start || pieces[0][0];
+                    if (pieces.length) {
+                        L.polyline(pieces.length === 1 ? pieces[0] : pieces, {color: route.color, weight: 5})
+                            .bindPopup(routePopup(route), {maxWidth: "100%"})
+                            .addTo(map);
+                    }
+                    {%- if this.cluster %}
+                    starts.push(start);
+                    {%- else %}
+                    pinMarker(route, start).addTo(markers);
+                    {%- endif %}
+                });
+
+                data.day_labels.forEach(function(label) {
+                    var html = "<div style='color: " + label.color + "; font-weight: bold; "
+                        + "font-size: 18px; text-shadow: 1px 1px 2px white, -1px -1px 2px white, "
+                        + "1px -1px 2px white, -1px 1px 2px white; white-space: nowrap;'>"
+                        + "Day " + label.day + "</div>";
+                    L.marker(label.location, {icon: L.divIcon({html: html, className: "empty"})})
+                        .addTo(dayLabels);
+                });
+
+                {%- if this.photos and not this.cluster %}
+                data.photos.forEach(function(photo) {
+                    photoMarker(photo).addTo(photos);
+                });
+                {%- endif %}
+                {%- if this.data_url %}
+                if (data.bounds) {
+                    map.fitBounds(data.bounds, {maxZoom: 13, padding: [3, 3]});
+                }
+                {%- endif %}
+                {%- if this.cluster %}
+                showClusters(data.clusters.pins, starts, markers, function(index) {
+                    return pinMarker(data.routes[index], starts[index]);
+                });
+                {%- if this.photos %}
+                var photoLocations = data.photos.map(function(photo) { return photo.location; });
+                showClusters(data.clusters.photos, photoLocations, photos, function(index) {
+                    return photoMarker(data.photos[index]);
+                });
+                {%- endif %}
+                {%- endif %}
+            }
+
+            {%- if this.data_url %}
+            // The manifest is small and always revalidated, it points to the
+            // content-hashed data file which can be cached forever.
+            fetch({{ this.data_url|tojson }}, {cache: "no-cache"})
+                .then(function(response) { return response.json(); })
+                .then(function(manifest) { return fetch(manifest.data); })
+                .then(function(response) { return response.json(); })
+                .then(draw);
+            {%- else %}
+            draw({{ this.data|tojson }});
+            {%- endif %}
+        })();
+        {% endmacro %}
+        """)
+
+    def __init__(self, marker_cluster, day_labels, photos=None, data_url=None, cluster=False):
+        """Photo markers are added to `photos` feature group (if given)
+
+        If `data_url` is set, the data is not embedded in the page, it is
+        fetched from the file given by the manifest at `data_url` instead
+        (see write_data()). With `cluster` set, markers are clustered
+        beforehand, `marker_cluster` should then be a plain FeatureGroup.
+        """
+        super().__init__()
+        self._name = "RouteLayer"
+        self.marker_cluster = marker_cluster
+        self.day_labels = day_labels
+        self.photos = photos
+        self.data_url = data_url
+        self.cluster = cluster
+        self.data = {"routes": [], "day_labels": [], "photos": []}
+        self._bounds = None
+        self._starts = []
+
+    def add_route(self, activity, track, date, color, icon, icon_color, polyline=True, pieces=None):
+        """Add route of `activity`, `track` is its Track (see track.py)
+
+        Without `polyline` only the activity pin is drawn (at the start).
+        With `pieces` (see dedup.py) only those parts of the track are drawn.
+        """
+        route = {
+            "id": activity["id"],
+            "name": activity["name"],
+            "date": date,
+            "distance": round(activity["distance"] / 1000, 1),
+            "elevation": round(activity["total_elevation_gain"]),
+            "color": color,
+            "icon": icon,
+            "icon_color": icon_color,
+        }
+        if polyline and pieces is None:
+            route["polyline"] = encode_polyline(track)
+        else:
+            route["start"] = [float(value) for value in track[0]]
+            if polyline and pieces:
+                route["polyline"] = [encode_polyline(piece) for piece in pieces]
+        self.data["routes"].append(route)
+        self._bounds = merge_bounds(self._bounds, track.bounds)
+        self._starts.append(track[0])
+
+    def add_day_label(self, day_number, location, color):
+        self.data["day_labels"].append({
+            "day": day_number,
+            "location": [float(location[0]), float(location[1])],
+            "color": color,
+        })
+
+    def add_photo(self, location, thumb_url, thumb_size, large_url):
+        self.data["photos"].append({
+            "location": location,
+            "thumb": thumb_url,
+            "thumb_size": thumb_size,
+            "large": large_url,
+        })
+
+    def _add_clusters(self):
+        if self.cluster:
+            self.data["clusters"] = {
+                "pins": cluster_hierarchy(self._starts),
+                "photos": cluster_hierarchy([photo["location"] for photo in self.data["photos"]]),
+            }
+
+    def write_data(self, manifest_path):
+        """Write data to a content-hashed file and point the manifest to it
+
+        Returns path of the data file. Data files of previous builds next to
+        the manifest are removed.
+        """
+        self.data["bounds"] = self._bounds
+        self._add_clusters()
+        content = json.dumps(self.data, separators=(",", ":")).encode()
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        directory = os.path.dirname(manifest_path)
+        base, ext = os.path.splitext(os.path.basename(manifest_path))
+        data_name = f"{base}.{digest}{ext}"
+        data_path = os.path.join(directory, data_name)
+        for old in glob.glob(os.path.join(glob.escape(directory), f"{glob.escape(base)}.*{ext}")):
+            if old != data_path:
+                os.remove(old)
+        with open(data_path, "wb") as f:
+            f.write(content)
+        with open(manifest_path, "w") as f:
+            json.dump({"data": data_name}, f)
+        return data_path
+
+    def render(self, **kwargs):
+        # MacroElement.render() would parse the rendered script as a template
+        # again, which breaks on "{{" or "{%" occurring in encoded polylines.
+        if not self.data_url:
+            self._add_clusters()
+        script = Element("{{ this.code }}")
+        script.code = self._template.module.__dict__["script"](self, kwargs)
+        self.get_root().script.add_child(script, name=self.get_name())
+
+    def _get_self_bounds(self):
+        if self._bounds is None:
+            return [[None, None], [None, None]]
+        return self._bounds
+
+
+def make_ids_stable(element, prefix="e"):
+    """Replace random ids of element and its children with sequential ones
+
+    folium gives every element a random id, which ends up in the JavaScript
+    variable names, so the same map would otherwise differ on every build.
+    """
+    stack = [element]
+    count = 0
+    while stack:
+        current = stack.pop(0)
+        current._id = f"{prefix}{count}"
+        count += 1
+        stack.extend(current._children.values())
@@ -0,0 +1,92 @@
+"""Douglas-Peucker simplification of decoded routes
+
+point_importance() runs Douglas-Peucker once and assigns every point the
+tolerance (in meters) up to which it is kept, simplify() keeps the points
+above a single tolerance (see build_map.py --simplify).
+
+Works with lists of (lat, lng) tuples as well as (N, 2) NumPy arrays
+(as returned by polyline.decode_polylines()).
+"""
+import json
+import math
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+EARTH_RADIUS = 6371000  # meters
+
+
+def _project(points):
+    """Project (lat, lng) points to local planar x, y coordinates in meters"""
+    lat0 = math.radians(points[len(points) // 2][0])
+    scale_x = EARTH_RADIUS * math.cos(lat0) * math.pi / 180
+    scale_y = EARTH_RADIUS * math.pi / 180
+    if np is not None:
+        array = np.asarray(points, dtype=float)
+        return array[:, 1] * scale_x, array[:, 0] * scale_y
+    return [p[1] * scale_x for p in points], [p[0] * scale_y for p in points]
+
+
+def _farthest(xs, ys, first, last):
+    """Return (index, distance) of the point between first and last farthest from that segment"""
+    x1, y1, x2, y2 = xs[first], ys[first], xs[last], ys[last]
+    dx, dy = x2 - x1, y2 - y1
+    length = math.hypot(dx, dy)
+    if np is not None:
+        px, py = xs[first + 1:last] - x1, ys[first + 1:last] - y1
+        if length:
+            distances = np.abs(px * dy - py * dx) / length
+        else:
+            distances = np.hypot(px, py)
+        index = int(np.argmax(distances))
+        return first + 1 + index, float(distances[index])
+    best, best_distance = first + 1, -1.0
+    for i in range(first + 1, last):
+        px, py = xs[i] - x1, ys[i] - y1
+        distance = abs(px * dy - py * dx) / length if length else math.hypot(px, py)
+        if distance > best_distance:
+            best, best_distance = i, distance
+    return best, best_distance
+
+
+def point_importance(points):
+    """Return list with the largest tolerance (meters) for which each point is kept
+
+    End points are always kept (infinite importance). A point's importance
+    never exceeds the importance of the point that split its segment, so
+    simplifying with a larger tolerance always gives a subset of the points.
+    """
+    count = len(points)
+    importance = [math.inf] * count
+    if count < 3:
+        return importance
+    xs, ys = _project(points)
+    stack = [(0, count - 1, math.inf)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        index, distance = _farthest(xs, ys, first, last)
+        importance[index] = min(distance, parent)
+        stack.append((first, index, importance[index]))
+        stack.append((index, last, importance[index]))
+    return importance
+
+
+def simplify(points, tolerance, importance=None):
+    """Return points kept by Douglas-Peucker with given tolerance in meters"""
+    if importance is None:
+        importance = point_importance(points)
+    keep = [i for i, value in enumerate(importance) if value > tolerance]
+    if np is not None and isinstance(points, np.ndarray):
+        return points[keep]
+    return [points[i] for i in keep]
+
+
+def encoded_size(points):
+    """Return size in bytes of the points as they end up in the map (JSON)"""
+    if np is not None and isinstance(points, np.ndarray):
+        points = points.tolist()
+    return len(json.dumps([list(point) for point in points]))
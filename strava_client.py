@@ -0,0 +1,213 @@
+"""Client for the Strava API
+
+StravaClient owns a single pooled keep-alive requests.Session used for all
+API calls. Idempotent (GET) requests are retried with exponential backoff on
+connection errors and 5xx responses. Every request goes through the client's
+RateLimiter (see rate_limit.py).
+
+Responses carrying an ETag are remembered, the next identical request is sent
+with If-None-Match and a 304 Not Modified answer is served from that cache.
+The cache can be persisted in the activity store (see activity_store.py).
+
+With a cassette (see cassette.py) all responses are recorded to it, or served
+from it without touching the network when replaying. Activities listed by
+date are keyed by the dates, not by the timestamps sent to Strava, which
+depend on the local timezone.
+
+Activities are listed PER_PAGE at a time. Whenever a page turns out to be
+full, the next one is requested right away and loads while the caller works
+on the activities of this one. Pages are only requested once it's clear
+there are more, so the listing never costs more requests than needed.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import activity_store
+import rate_limit
+
+STRAVA_API_URL = os.environ.get("STRAVA_API_URL", "https://www.strava.com/api/v3")
+
+POOL_SIZE = 8
+RETRIES = 3
+RETRY_BACKOFF = 0.5  # seconds, doubled after each retry
+PER_PAGE = 200  # Maximum allowed by Strava
+
+
+class StravaAPIError(Exception):
+    """Raised when listing activities fails, so a build doesn't go on with some missing"""
+
+
+def date_to_timestamp(date):
+    return datetime.fromisoformat(date).timestamp() if date else None
+
+
+class StravaClient:
+    def __init__(self, access_token, api_url=STRAVA_API_URL, rate_limiter=None,
+                 pool_size=POOL_SIZE, store_path=None, stats=None, cassette=None):
+        """Create client for given access token
+
+        If `store_path` is set, the ETag cache is loaded from the activity
+        store at that path and saved back to it on close(). Requests are
+        counted in `stats` (BuildStats) if given. Responses are recorded to
+        (or replayed from) `cassette` if given, it's saved on close().
+        """
+        self.api_url = api_url
+        self.stats = stats
+        self.cassette = cassette
+        self.rate_limiter = rate_limiter or rate_limit.RateLimiter()
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {access_token}",
+            "Accept-Encoding": "gzip, deflate",
+        })
+        retry = Retry(
+            total=RETRIES,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.store_path = store_path
+        self.etag_cache = {}
+        self._used_urls = set()
+        if store_path:
+            conn = activity_store.open_store(store_path)
+            self.etag_cache = activity_store.load_http_cache(conn)
+            conn.close()
+
+    def close(self):
+        if self.store_path:
+            conn = activity_store.open_store(self.store_path)
+            activity_store.save_http_cache(conn, self.etag_cache, self._used_urls)
+            conn.close()
+        if self.cassette is not None and not self.cassette.replay:
+            self.cassette.save()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, path, params=None, priority=rate_limit.HIGH, cassette_params=None):
+        """GET `path` of the API, returns the response
+
+        A 304 Not Modified response is turned into a 200 one with the
+        cached body, so callers don't need to care about conditional requests.
+        The response is recorded to (or replayed from) the cassette with
+        `cassette_params` instead of `params` in its key, if given.
+        """
+        url = f"{self.api_url}{path}"
+        key = requests.Request("GET", url, params=params).prepare().url
+        cassette_key = key
+        if cassette_params is not None:
+            cassette_key = requests.Request("GET", url, params=cassette_params).prepare().url
+        cassette_key = cassette_key[len(self.api_url):]
+        if self.cassette is not None and self.cassette.replay:
+            response = self.cassette.play(cassette_key, key)
+            if self.stats is not None:
+                self.stats.record_request(path, response.status_code)
+            return response
+        self._used_urls.add(key)
+        headers = {}
+        cached = self.etag_cache.get(key)
+        if cached:
+            headers["If-None-Match"] = cached[0]
+        response = self.rate_limiter.request(
+            self.session, "GET", url, priority=priority, params=params, headers=headers
+        )
+        if self.stats is not None:
+            self.stats.record_request(path, response.status_code)
+        if response.status_code == requests.codes.not_modified and cached:
+            response.status_code = requests.codes.ok
+            response._content = cached[1].encode()
+        elif response.status_code == requests.codes.ok and response.headers.get("ETag"):
+            self.etag_cache[key] = (response.headers["ETag"], response.text)
+        if self.cassette is not None:
+            self.cassette.record(cassette_key, response)
+        return response
+
+    def get_activities(self, since=None, until=None, after=None, before=None, per_page=PER_PAGE):
+        """Yield activities between since/until dates (or after/before timestamps)
+
+        Activities are yielded page by page as they arrive, the next page
+        (once a full one came back) loads while the caller works on them.
+        Listing stops at the first page that isn't full. Raises
+        StravaAPIError if a page can't be fetched (after retries).
+        """
+        payload = {"per_page": per_page}
+        # Cassette keys have the dates, the same whatever the local timezone
+        cassette_payload = {"per_page": per_page}
+        for name, date, timestamp in (("after", since, after), ("before", until, before)):
+            if date:
+                payload[name], cassette_payload[name] = date_to_timestamp(date), date
+            elif timestamp is not None:
+                payload[name] = cassette_payload[name] = timestamp
+
+        def get_page(page):
+            return self.get("/athlete/activities", params={**payload, "page": page},
+                            cassette_params={**cassette_payload, "page": page})
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        page = 1
+        future = executor.submit(get_page, page)
+        try:
+            while True:
+                response = future.result()
+                if response.status_code != requests.codes.ok:
+                    raise StravaAPIError(
+                        f"Failed to get activities from {self.api_url}/athlete/activities "
+                        f"with {dict(payload, page=page)}: {response.status_code} {response.text}"
+                    )
+                activities = response.json()
+                if len(activities) < per_page:
+                    yield from activities
+                    break
+                # The next page loads while the caller works on this one
+                page += 1
+                future = executor.submit(get_page, page)
+                yield from activities
+        finally:
+            # The next page is of no use if the caller stopped early
+            executor.shutdown(cancel_futures=True)
+
+    def get_activity_photos(self, activity_id, size=None):
+        payload = {"photo_sources": True}
+        if size is not None:
+            payload["size"] = size
+        response = self.get(
+            f"/activities/{activity_id}/photos", params=payload, priority=rate_limit.LOW
+        )
+        if response.status_code != requests.codes.ok:
+            print("Failed to get photos, skipping...")
+            print(f"Status code: {response.status_code}")
+            print(f"Response: {response.text}")
+            return []
+        return response.json()
+
+    def get_activity_streams(self, activity_id, keys):
+        """Return streams of the activity keyed by type, None if the request failed
+
+        Activities without streams (e.g. manually added ones) give an empty dict.
+        """
+        payload = {"keys": ",".join(keys), "key_by_type": "true"}
+        response = self.get(
+            f"/activities/{activity_id}/streams", params=payload, priority=rate_limit.LOW
+        )
+        if response.status_code == requests.codes.not_found:
+            return {}
+        if response.status_code != requests.codes.ok:
+            print("Failed to get streams, skipping...")
+            print(f"Status code: {response.status_code}")
+            print(f"Response: {response.text}")
+            return None
+        return response.json()
@@ -0,0 +1,152 @@
+"""Full resolution activity streams cached on disk
+
+Strava's summary_polyline is heavily downsampled. The streams of an activity
+(/activities/{id}/streams) have every recorded point: latlng, altitude,
+distance and time. They never change, so each activity's streams are fetched
+once and kept in STREAMS_DIR as a .npy file holding a structured array of
+STREAM_DTYPE (28 bytes per point). Files are opened memory-mapped, so only the
+streams currently in use are read into memory.
+
+build_map.py --streams draws routes from them (simplified at render time),
+trip_stats.py --streams adds elevation and grade stats. Requires NumPy.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, but needed for streams
+    np = None
+
+import simplify
+
+STREAMS_DIR = os.path.join("data", "streams")
+STREAM_KEYS = ("latlng", "altitude", "distance", "time")
+STREAM_DTYPE = [
+    ("lat", "f8"),
+    ("lng", "f8"),
+    ("altitude", "f4"),  # meters, NaN if not recorded
+    ("distance", "f4"),  # meters from the start
+    ("time", "i4"),  # seconds from the start
+]
+ROUTE_TOLERANCE = 2  # meters, simplification of routes drawn from streams
+RESAMPLE_SPACING = 20  # meters, altitude is resampled to this spacing for stats
+GRADE_WINDOW = 100  # meters over which grade is computed
+
+
+def stream_path(activity_id, directory=STREAMS_DIR):
+    return os.path.join(directory, f"{activity_id}.npy")
+
+
+def to_array(streams):
+    """Return streams as returned by the API (keyed by type) as STREAM_DTYPE array
+
+    Activities without GPS give an empty array.
+    """
+    latlng = streams.get("latlng", {}).get("data") or []
+    array = np.zeros(len(latlng), dtype=STREAM_DTYPE)
+    if not latlng:
+        return array
+    latlng = np.asarray(latlng, dtype=float)
+    array["lat"], array["lng"] = latlng[:, 0], latlng[:, 1]
+    for key, default in (("altitude", np.nan), ("distance", 0), ("time", 0)):
+        data = streams.get(key, {}).get("data")
+        array[key] = data if data and len(data) == len(array) else default
+    return array
+
+
+def save_stream(activity_id, array, directory=STREAMS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = stream_path(activity_id, directory)
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_file, path)
+
+
+def load_stream(activity_id, directory=STREAMS_DIR):
+    """Return memory-mapped stream array of the activity, None if not fetched yet"""
+    path = stream_path(activity_id, directory)
+    if not os.path.isfile(path):
+        return None
+    return np.load(path, mmap_mode="r")
+
+
+def fetch_streams(client, activities, directory=STREAMS_DIR, refresh=False, max_workers=None):
+    """Fetch streams of activities not in `directory` yet, return number fetched
+
+    With `refresh` all of them are requested again (e.g. when recording a
+    cassette). Streams that failed to be fetched are left out and requested
+    again next time.
+    """
+    missing = [
+        activity["id"] for activity in activities
+        if refresh or not os.path.isfile(stream_path(activity["id"], directory))
+    ]
+    if not missing:
+        return 0
+    print(f"Fetching streams: {len(missing)} requests")
+    fetched = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda activity_id: client.get_activity_streams(activity_id, STREAM_KEYS),
+                               missing)
+        for activity_id, result in zip(missing, results):
+            if result is not None:
+                save_stream(activity_id, to_array(result), directory)
+                fetched += 1
+    return fetched
+
+
+def route_points(stream, tolerance=ROUTE_TOLERANCE):
+    """Return (N, 2) lat/lng array of the stream simplified with `tolerance` meters"""
+    points = np.column_stack((stream["lat"], stream["lng"]))
+    return simplify.simplify(points, tolerance) if tolerance else points
+
+
+def replace_routes(activities, coordinates, offsets, tolerance=ROUTE_TOLERANCE, directory=STREAMS_DIR):
+    """Replace decoded summary polylines with routes from streams where available
+
+    Takes and returns `coordinates` and `offsets` as returned by
+    polyline.decode_polylines(), plus a list with the number of stream points
+    each route was simplified from (0 for routes not replaced). Streams are
+    read (and simplified) one activity at a time.
+    """
+    routes = []
+    stream_points = []
+    for i, activity in enumerate(activities):
+        stream = load_stream(activity["id"], directory)
+        if stream is not None and len(stream):
+            routes.append(route_points(stream, tolerance))
+            stream_points.append(len(stream))
+        else:
+            routes.append(coordinates[offsets[i]:offsets[i + 1]])
+            stream_points.append(0)
+    lengths = [len(route) for route in routes]
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    coordinates = np.concatenate(routes) if routes else np.zeros((0, 2))
+    return coordinates, offsets, stream_points
+
+
+def elevation_stats(stream):
+    """Return (gain, loss, max altitude, max grade %) of a stream, None if it has no altitude
+
+    Altitude is resampled by distance every RESAMPLE_SPACING meters, which
+    smooths out GPS/barometer noise, grade is the steepest climb or descent
+    over GRADE_WINDOW meters.
+    """
+    valid = ~np.isnan(stream["altitude"])
+    if valid.sum() < 2:
+        return None
+    distance = stream["distance"][valid].astype(float)
+    altitude = stream["altitude"][valid].astype(float)
+    grid = np.arange(0, distance[-1] + RESAMPLE_SPACING, RESAMPLE_SPACING)
+    resampled = np.interp(grid, distance, altitude)
+    diffs = np.diff(resampled)
+    window = GRADE_WINDOW // RESAMPLE_SPACING
+    if len(resampled) > window:
+        grades = (resampled[window:] - resampled[:-window]) / GRADE_WINDOW * 100
+        max_grade = float(np.abs(grades).max())
+    else:
+        max_grade = 0.0
+    return (float(diffs[diffs > 0].sum()), float(-diffs[diffs < 0].sum()),
+            float(altitude.max()), max_grade)
@@ -0,0 +1,26 @@
+import pytest
+
+from benchmarks.fake_strava import FakeStrava, FakeStravaHandler
+from benchmarks.synthetic import generate_activities
+
+
+class FlakyHandler(FakeStravaHandler):
+    """Answers the second page of activity listings with 401 while the server is `failing`"""
+
+    def do_GET(self):
+        if self.server.failing and self.path.startswith("/athlete/activities") and "&page=2" in self.path:
+            self.send_json(401, {"message": "Authorization Error"})
+            return
+        super().do_GET()
+
+
+@pytest.fixture
+def fake_strava():
+    """FakeStrava with 600 activities, two a day from 2024-03-15"""
+    server = FakeStrava(generate_activities(600), limits=(10 ** 6, 10 ** 6))
+    server.RequestHandlerClass = FlakyHandler
+    server.failing = False
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,45 @@
+import json
+import random
+
+import clustering
+
+
+def clustered_locations(count, seed=0):
+    """Return `count` (lat, lng) locations scattered around a few places"""
+    rnd = random.Random(seed)
+    places = [(rnd.uniform(44, 48), rnd.uniform(5, 12)) for _ in range(30)]
+    locations = []
+    for _ in range(count):
+        lat, lng = rnd.choice(places)
+        locations.append((round(lat + rnd.gauss(0, 0.2), 6), round(lng + rnd.gauss(0, 0.3), 6)))
+    return locations
+
+
+def shown(hierarchy, zoom):
+    """Return (indices of locations, clusters) shown at `zoom`"""
+    locations = [index for index, min_zoom in enumerate(hierarchy["zooms"]) if min_zoom <= zoom]
+    clusters = [cluster for cluster in hierarchy["clusters"] if cluster[3] <= zoom < cluster[4]]
+    return locations, clusters
+
+
+def test_every_location_is_shown_once_at_every_zoom():
+    locations = clustered_locations(1000)
+    hierarchy = clustering.cluster_hierarchy(locations)
+    for zoom in range(clustering.MAX_ZOOM + 2):
+        singles, clusters = shown(hierarchy, zoom)
+        assert len(singles) + sum(cluster[2] for cluster in clusters) == len(locations)
+    assert shown(hierarchy, clustering.MAX_ZOOM + 1) == (list(range(len(locations))), [])
+
+
+def test_close_locations_split_up_when_zooming_in():
+    hierarchy = clustering.cluster_hierarchy([(46.0, 7.0), (46.0001, 7.0001), (10.0, 10.0)])
+    assert shown(hierarchy, 5) == ([2], [[46.00005, 7.00005, 2, 0, hierarchy["zooms"][0]]])
+    assert hierarchy["zooms"][0] == hierarchy["zooms"][1] > 5
+    assert hierarchy["zooms"][2] == 0
+
+
+def test_hierarchy_is_smaller_than_the_locations():
+    locations = clustered_locations(10000)
+    hierarchy = clustering.cluster_hierarchy(locations)
+    size = len(json.dumps(hierarchy, separators=(",", ":")))
+    assert size < len(json.dumps(locations, separators=(",", ":")))
@@ -0,0 +1,49 @@
+import math
+
+import numpy as np
+
+import dedup
+
+METERS_PER_DEGREE = 111320
+
+
+def straight_route(points=100, spacing=60, lat=46.0, lng=7.0):
+    """Return (N, 2) route heading north with a point every `spacing` meters"""
+    lats = lat + np.arange(points) * spacing / METERS_PER_DEGREE
+    return np.column_stack((lats, np.full(points, lng)))
+
+
+def east(meters, lat=46.0):
+    return meters / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+
+
+def test_out_and_back_offset_return_leg_is_removed():
+    out = straight_route()
+    back = out[::-1] + [0, east(3.9)]
+    index = dedup.OverlapIndex()
+    pieces = index.add(np.concatenate((out, back)))
+    assert index.removed >= 95
+    # The way out is kept in one piece
+    assert len(pieces) == 1
+    assert np.array_equal(pieces[0][:len(out)], out)
+
+
+def test_out_and_back_with_gps_noise_is_removed():
+    rng = np.random.default_rng(0)
+    out = straight_route()
+    back = out[::-1] + np.column_stack((
+        rng.normal(0, 4, len(out)) / METERS_PER_DEGREE, east(rng.normal(0, 4, len(out))),
+    ))
+    index = dedup.OverlapIndex()
+    index.add(np.concatenate((out, back)))
+    assert index.removed >= 90
+
+
+def test_repeated_route_is_removed_and_separate_route_kept():
+    route = straight_route()
+    index = dedup.OverlapIndex()
+    assert [len(piece) for piece in index.add(route)] == [len(route)]
+    assert index.add(route) == []
+    elsewhere = route + [0, east(500)]
+    assert [len(piece) for piece in index.add(elsewhere)] == [len(route)]
+    assert index.removed == len(route)
@@ -0,0 +1,12 @@
+import pytest
+
+from strava_client import StravaAPIError, StravaClient
+
+
+def test_failed_page_raises_instead_of_ending_the_listing(fake_strava):
+    fake_strava.failing = True
+    activities = []
+    with StravaClient("token", api_url=fake_strava.url) as client:
+        with pytest.raises(StravaAPIError, match="401"):
+            activities.extend(client.get_activities(since="2000-01-01"))
+    assert len(activities) == 200
@@ -0,0 +1,38 @@
+import pytest
+
+import activity_store
+from build_map import sync_activities
+from strava_client import StravaAPIError, StravaClient, date_to_timestamp
+from webhook_server import apply_event
+
+
+def test_failed_backfill_is_not_marked_synced(fake_strava, tmp_path):
+    store = str(tmp_path / "activities.sqlite")
+    with StravaClient("token", api_url=fake_strava.url) as client:
+        sync_activities(client, since="2024-08-01", store_path=store)
+        fake_strava.failing = True
+        with pytest.raises(StravaAPIError):
+            sync_activities(client, since="2024-03-01", store_path=store)
+        conn = activity_store.open_store(store)
+        assert activity_store.get_meta(conn, "synced_after") == date_to_timestamp("2024-08-01")
+        conn.close()
+
+        fake_strava.failing = False
+        activities = sync_activities(client, since="2024-03-01", store_path=store)
+    assert len(activities) == 600
+
+
+def test_webhook_event_after_failed_gap_is_not_saved(fake_strava, tmp_path):
+    store = str(tmp_path / "activities.sqlite")
+    conn = activity_store.open_store(store)
+    activity_store.save_activities(conn, fake_strava.activities[:10])
+    activity_store.mark_synced(conn, date_to_timestamp("2024-03-01"))
+    fake_strava.failing = True
+    with StravaClient("token", api_url=fake_strava.url) as client:
+        with pytest.raises(StravaAPIError):
+            apply_event(client, {"object_type": "activity", "object_id": fake_strava.activities[-1]["id"],
+                                 "aspect_type": "create"}, store_path=store)
+    latest = activity_store.latest_start(conn, date_to_timestamp("2024-03-01"))
+    conn.close()
+    # Only activities of the gap are stored, the new one isn't
+    assert latest < activity_store.start_timestamp(fake_strava.activities[-1])
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""Caching proxy for the map's tile layers
+
+The map's Thunderforest and Stadia Maps tile layers count every tile every
+viewer loads against the accounts' quota, and the Thunderforest API key ends
+up in the page. Instead, tiles can be served by this proxy: it keeps tiles
+in one MBTiles file (SQLite) per layer in TILE_CACHE_DIR, fetched upstream
+with the API keys added on the server.
+
+    ./tile_cache.py seed --since 2026-04-24 --until 2026-05-07 --zoom 8-13
+    ./tile_cache.py serve --port 8090
+    ./build_map.py --tile-proxy http://localhost:8090 ...
+
+`seed` fetches all tiles covering the bounds of a trip's activities (from
+the local activity store, see build_map.py --sync) for a range of zoom
+levels in advance and records that area in the MBTiles file. `serve` only
+serves cached tiles. With --fetch-missing it fetches tiles missing from the
+cache upstream, but only within the seeded areas and zoom levels, so the
+proxy can't be used to spend the quota on tiles of anywhere else.
+
+Stadia Maps only serves tiles fetched from a server with an API key
+(--stadia-key or STADIA_API_KEY), without one seed only the Thunderforest
+layer (--layer thunderforest-outdoors). Upstream urls can be changed with
+THUNDERFOREST_TILE_URL and STADIA_TILE_URL, e.g. to test against a local
+fake (see benchmarks/fake_tiles.py).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import os
+import re
+import sqlite3
+import threading
+
+from dotenv import load_dotenv
+import requests
+from requests.adapters import HTTPAdapter
+
+import activity_store
+from polyline import decode_polyline
+from strava_client import date_to_timestamp
+from trips import TRIPS_CONFIG, load_trips
+from web_mercator import mercator
+
+TILE_CACHE_DIR = os.path.join("data", "tiles")
+
+# Upstream url templates, {apikey} is filled in from the layer's API key
+TILE_LAYERS = {
+    "thunderforest-outdoors": {
+        "url": os.environ.get(
+            "THUNDERFOREST_TILE_URL",
+            "https://tile.thunderforest.com/outdoors/{z}/{x}/{y}.png?apikey={apikey}",
+        ),
+        "format": "png",
+        "key": "THUNDERFOREST_API_KEY",
+    },
+    "stamen-terrain": {
+        "url": os.environ.get(
+            "STADIA_TILE_URL", "https://tiles.stadiamaps.com/tiles/stamen_terrain/{z}/{x}/{y}.jpg?api_key={apikey}"
+        ),
+        "format": "jpg",
+        "key": "STADIA_API_KEY",
+    },
+}
+
+SEED_ZOOMS = "5-13"
+MAX_SEED_TILES = 20000
+FETCH_WORKERS = 4
+CACHE_MAX_AGE = 7 * 24 * 60 * 60  # seconds browsers may keep a tile
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER,
+    tile_column INTEGER,
+    tile_row INTEGER,
+    tile_data BLOB,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+CREATE TABLE IF NOT EXISTS seeded_areas (
+    min_zoom INTEGER,
+    max_zoom INTEGER,
+    south REAL,
+    west REAL,
+    north REAL,
+    east REAL,
+    PRIMARY KEY (min_zoom, max_zoom, south, west, north, east)
+);
+"""
+
+CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg"}
+
+
+def api_keys(stadia_key=None):
+    """Return API keys by layer, from the environment (or .env) unless given"""
+    keys = {layer: os.environ.get(config["key"], "") for layer, config in TILE_LAYERS.items()}
+    if stadia_key:
+        keys["stamen-terrain"] = stadia_key
+    return keys
+
+
+def tile_url(layer, z, x, y, keys):
+    return TILE_LAYERS[layer]["url"].format(z=z, x=x, y=y, apikey=keys[layer])
+
+
+def parse_zooms(text):
+    """Return range of zoom levels from e.g. "5-13" or "12" """
+    first, _, last = text.partition("-")
+    return range(int(first), int(last or first) + 1)
+
+
+def tile_ranges(bounds, zoom):
+    """Return ranges of x and y of the tiles at `zoom` covering bounds [[south, west], [north, east]]"""
+    (south, west), (north, east) = bounds
+    count = 2 ** zoom
+    left, top = mercator(north, west)
+    right, bottom = mercator(south, east)
+    return (range(int(left * count), min(int(right * count), count - 1) + 1),
+            range(int(top * count), min(int(bottom * count), count - 1) + 1))
+
+
+def tiles_in_bounds(bounds, zoom):
+    """Yield (x, y) of all tiles at `zoom` covering bounds [[south, west], [north, east]]"""
+    xs, ys = tile_ranges(bounds, zoom)
+    for x in xs:
+        for y in ys:
+            yield x, y
+
+
+class TileStore:
+    """Tiles of one layer in an MBTiles file, safe to use from several threads"""
+
+    def __init__(self, path, layer):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+            [("name", layer), ("format", TILE_LAYERS[layer]["format"]), ("type", "baselayer")],
+        )
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _row(z, y):
+        # MBTiles rows count from the bottom (TMS)
+        return 2 ** z - 1 - y
+
+    def get(self, z, x, y):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, self._row(z, y)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def has(self, z, x, y):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, self._row(z, y)),
+            ).fetchone() is not None
+
+    def put(self, z, x, y, data, commit=True):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", (z, x, self._row(z, y), data)
+            )
+            if commit:
+                self.conn.commit()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def add_seeded_area(self, bounds, zooms):
+        (south, west), (north, east) = bounds
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO seeded_areas VALUES (?, ?, ?, ?, ?, ?)",
+                (zooms[0], zooms[-1], south, west, north, east),
+            )
+            self.conn.commit()
+
+    def is_seeded(self, z, x, y):
+        """Return whether the tile is within an area seeded at its zoom level"""
+        with self.lock:
+            areas = self.conn.execute(
+                "SELECT south, west, north, east FROM seeded_areas WHERE min_zoom <= ? AND ? <= max_zoom",
+                (z, z),
+            ).fetchall()
+        for south, west, north, east in areas:
+            xs, ys = tile_ranges([[south, west], [north, east]], z)
+            if x in xs and y in ys:
+                return True
+        return False
+
+    def close(self):
+        self.conn.close()
+
+
+def open_stores(directory=TILE_CACHE_DIR):
+    return {layer: TileStore(os.path.join(directory, f"{layer}.mbtiles"), layer) for layer in TILE_LAYERS}
+
+
+def create_session(pool_size=FETCH_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def fetch_tile(session, layer, z, x, y, keys):
+    """Return tile from upstream, None if that failed"""
+    try:
+        response = session.get(tile_url(layer, z, x, y, keys), timeout=30)
+    except requests.RequestException as e:
+        print(f"Failed to fetch tile {layer}/{z}/{x}/{y}: {e}")
+        return None
+    if response.status_code != requests.codes.ok:
+        print(f"Failed to fetch tile {layer}/{z}/{x}/{y}: {response.status_code}")
+        return None
+    return response.content
+
+
+def seed(store, layer, bounds, zooms, keys, max_workers=FETCH_WORKERS, max_tiles=MAX_SEED_TILES):
+    """Fetch all tiles of `layer` covering `bounds` at `zooms` not in `store` yet
+
+    The area is recorded as seeded, see TileStore.is_seeded(). Returns
+    (number of tiles covering bounds, number fetched).
+    """
+    tiles = [(z, x, y) for z in zooms for x, y in tiles_in_bounds(bounds, z)]
+    if len(tiles) > max_tiles:
+        raise SystemExit(f"{len(tiles)} tiles of {layer} to seed, more than the maximum of {max_tiles}")
+    missing = [tile for tile in tiles if not store.has(*tile)]
+    fetched = 0
+    if missing:
+        print(f"Fetching {layer} tiles: {len(missing)} of {len(tiles)}")
+        with create_session(max_workers) as session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda tile: fetch_tile(session, layer, *tile, keys), missing)
+            for tile, data in zip(missing, results):
+                if data is not None:
+                    store.put(*tile, data, commit=False)
+                    fetched += 1
+        store.commit()
+    store.add_seeded_area(bounds, zooms)
+    return len(tiles), fetched
+
+
+def activity_bounds(activities):
+    """Return bounds of all routes of activities, None if there are none"""
+    points = [
+        point for activity in activities
+        for point in decode_polyline(activity["map"]["summary_polyline"] or "")
+    ]
+    if not points:
+        return None
+    lats, lngs = [point[0] for point in points], [point[1] for point in points]
+    return [[min(lats), min(lngs)], [max(lats), max(lngs)]]
+
+
+class TileProxy(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, stores, keys=None, fetch_missing=False):
+        """With `fetch_missing` tiles within seeded areas are fetched upstream using `keys`"""
+        super().__init__(address, TileProxyHandler)
+        self.stores = stores
+        self.keys = keys
+        self.fetch_missing = fetch_missing
+        self.session = create_session()
+        self.counts = {"hits": 0, "misses": 0}
+        self.counts_lock = threading.Lock()
+
+    def count(self, name):
+        with self.counts_lock:
+            self.counts[name] += 1
+
+
+class TileProxyHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        match = re.fullmatch(r"/([\w-]+)/(\d+)/(\d+)/(\d+)\.(png|jpg)", self.path.split("?")[0])
+        if not match or match.group(1) not in server.stores:
+            self.send_error(404)
+            return
+        layer = match.group(1)
+        z, x, y = (int(value) for value in match.group(2, 3, 4))
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            self.send_error(404)
+            return
+        store = server.stores[layer]
+        data = store.get(z, x, y)
+        if data is not None:
+            server.count("hits")
+        elif server.fetch_missing and store.is_seeded(z, x, y):
+            server.count("misses")
+            data = fetch_tile(server.session, layer, z, x, y, server.keys)
+            if data is None:
+                self.send_error(502)
+                return
+            store.put(z, x, y, data)
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[TILE_LAYERS[layer]["format"]])
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", f"public, max-age={CACHE_MAX_AGE}")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def seed_command(args):
+    if args.trips:
+        trips = load_trips(args.trips, args.trip)
+    elif args.since:
+        trips = [{"name": args.since, "since": args.since, "until": args.until}]
+    else:
+        raise SystemExit("Either --since or --trips is needed")
+    conn = activity_store.open_store(activity_store.ACTIVITY_STORE)
+    stores = open_stores(args.cache_dir)
+    layers = args.layer or list(TILE_LAYERS)
+    try:
+        for trip in trips:
+            activities = activity_store.load_activities(
+                conn, after=date_to_timestamp(trip["since"]), before=date_to_timestamp(trip["until"])
+            )
+            bounds = activity_bounds(activities)
+            if bounds is None:
+                print(f"{trip['name']}: no routes in the activity store")
+                continue
+            for layer in layers:
+                total, fetched = seed(
+                    stores[layer], layer, bounds, parse_zooms(args.zoom), api_keys(args.stadia_key),
+                    max_tiles=args.max_tiles,
+                )
+                print(f"{trip['name']}: {total} {layer} tiles, {fetched} fetched")
+    finally:
+        conn.close()
+        for store in stores.values():
+            store.close()
+
+
+def serve_command(args):
+    server = TileProxy(
+        (args.host, args.port), open_stores(args.cache_dir), api_keys(args.stadia_key), args.fetch_missing
+    )
+    print(f"Serving tiles on port {args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Tiles served from cache: {server.counts['hits']}, fetched: {server.counts['misses']}")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Cache map tiles locally and serve them to the map")
+    parser.add_argument(
+        "--cache-dir", default=TILE_CACHE_DIR, help=f"Directory of the MBTiles files (default: {TILE_CACHE_DIR})"
+    )
+    parser.add_argument(
+        "--stadia-key",
+        help="Stadia Maps API key, needed to fetch stamen-terrain tiles (default: STADIA_API_KEY)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="Fetch tiles covering trips in advance")
+    seed_parser.add_argument("--since", help="Start date (YYYY-MM-DD) of a single trip")
+    seed_parser.add_argument("--until", help="End date (YYYY-MM-DD) of a single trip")
+    seed_parser.add_argument(
+        "--trips",
+        nargs="?",
+        const=TRIPS_CONFIG,
+        metavar="CONFIG",
+        help=f"Seed tiles of all trips in the trips config (default: {TRIPS_CONFIG})",
+    )
+    seed_parser.add_argument(
+        "--trip", action="append", metavar="NAME", help="Only this trip from the trips config"
+    )
+    seed_parser.add_argument(
+        "--zoom", default=SEED_ZOOMS, help=f"Zoom level or range of them (default: {SEED_ZOOMS})"
+    )
+    seed_parser.add_argument(
+        "--layer", action="append", choices=list(TILE_LAYERS), help="Only seed this layer (default: all)"
+    )
+    seed_parser.add_argument(
+        "--max-tiles",
+        type=int,
+        default=MAX_SEED_TILES,
+        help=f"Refuse to seed more tiles per layer and trip (default: {MAX_SEED_TILES})",
+    )
+    seed_parser.set_defaults(func=seed_command)
+
+    serve_parser = commands.add_parser("serve", help="Serve cached tiles")
+    serve_parser.add_argument("--host", default="", help="Address to listen on (default: all)")
+    serve_parser.add_argument("--port", type=int, default=8090, help="Port to listen on (default: 8090)")
+    serve_parser.add_argument(
+        "--fetch-missing",
+        action="store_true",
+        help="Fetch tiles missing from the cache upstream, only within seeded areas and zoom levels",
+    )
+    serve_parser.set_defaults(func=serve_command)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
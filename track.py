@@ -0,0 +1,83 @@
+"""Compact representation of decoded routes
+
+A Track keeps the coordinates of one route in a flat array('d')
+(lat0, lng0, lat1, lng1, ...) instead of a list of (lat, lng) tuples, which
+takes 16 bytes per point instead of ~100. Its bounding box is computed once
+on creation, so the map bounds can be derived from the tracks without going
+over all points again. Day number and color are filled in when the track is
+placed on the map.
+"""
+from array import array
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+
+def flat_coordinates(points):
+    """Return points (list of (lat, lng) or (N, 2) NumPy array) as flat array('d')"""
+    if np is not None and isinstance(points, np.ndarray):
+        coords = array("d")
+        coords.frombytes(np.ascontiguousarray(points, dtype=float).tobytes())
+        return coords
+    return array("d", chain.from_iterable(points))
+
+
+def merge_bounds(a, b):
+    """Return bounds ([[south, west], [north, east]]) covering both, either may be None"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return [
+        [min(a[0][0], b[0][0]), min(a[0][1], b[0][1])],
+        [max(a[1][0], b[1][0]), max(a[1][1], b[1][1])],
+    ]
+
+
+class Track:
+    __slots__ = ("activity_id", "coords", "bounds", "distance", "day_number", "color")
+
+    def __init__(self, activity_id, points, distance=0.0):
+        self.activity_id = activity_id
+        self.coords = flat_coordinates(points)
+        self.distance = distance
+        self.day_number = None
+        self.color = None
+        self.bounds = None
+        if self.coords:
+            lats, lngs = self.coords[0::2], self.coords[1::2]
+            self.bounds = [[min(lats), min(lngs)], [max(lats), max(lngs)]]
+
+    def __len__(self):
+        return len(self.coords) // 2
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("track index out of range")
+        return self.coords[2 * index], self.coords[2 * index + 1]
+
+    def __iter__(self):
+        coords = iter(self.coords)
+        return zip(coords, coords)
+
+    def points(self):
+        """Return points as (N, 2) NumPy array sharing the track's memory, or list of tuples"""
+        if np is not None:
+            return np.frombuffer(self.coords, dtype=float).reshape(-1, 2)
+        return list(self)
+
+    def midpoint(self):
+        return self[len(self) // 2]
+
+
+def tracks_from_decoded(activities, coordinates, offsets):
+    """Return one Track per activity from decode_polylines() output"""
+    return [
+        Track(activity["id"], coordinates[offsets[i]:offsets[i + 1]], activity["distance"])
+        for i, activity in enumerate(activities)
+    ]
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""Trip statistics without building a map
+
+write_hikes_csv() streams the per-hike CSV (hikes.csv) that build_map.py
+writes next to each map: day (from "Day N" in the activity name), date,
+name, distance, ascent and the running total distance.
+
+The script itself computes aggregates from the local activity store (see
+build_map.py --sync): activities are loaded into a columnar table (a NumPy
+structured array, see activity_table()) and summed per trip day and per
+trip with vectorized operations. Results are streamed to CSV with the csv
+module, or written as JSON, e.g.:
+
+    ./trip_stats.py --since 2026-04-24 --until 2026-05-07
+    ./trip_stats.py --trips --json trips-stats.json
+
+With --streams, elevation gain, max altitude and max grade are computed from
+the cached full resolution streams (see streams.py), one activity at a time.
+"""
+from datetime import datetime
+import argparse
+import csv
+import json
+import re
+import sys
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, but needed for aggregates
+    np = None
+
+import activity_store
+import streams
+from strava_client import date_to_timestamp
+from trips import TRIPS_CONFIG, load_trips
+
+HIKES_CSV_HEADER = ("Day", "Date", "Name", "Distance", "Ascend", "Total Dist.", "Strava Link")
+DAY_PATTERN = re.compile(r"Day (\d+)")
+
+DAILY_FIELDS = ("trip", "day", "date", "activities", "distance_km", "elevation_m",
+                "moving_time_h", "total_distance_km")
+STREAM_FIELDS = ("stream_gain_m", "max_altitude_m", "max_grade_pct")
+
+
+def hike_rows(activities):
+    """Yield hikes.csv rows of the hikes among activities"""
+    dist_total = 0
+    for activity in activities:
+        if activity["type"] != "Hike":
+            continue
+        match = DAY_PATTERN.search(activity["name"])
+        dist = round(activity["distance"] / 1000, 1)
+        dist_total = round(dist_total + dist, 1)
+        yield (
+            match.group(1) if match else "0",
+            activity["start_date_local"][:10],
+            activity["name"],
+            dist,
+            round(activity["total_elevation_gain"]),
+            dist_total,
+            f"https://www.strava.com/activities/{activity['id']}",
+        )
+
+
+def write_hikes_csv(path, activities):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(HIKES_CSV_HEADER)
+        writer.writerows(hike_rows(activities))
+
+
+def activity_table(activities, first_day):
+    """Return activities as a NumPy structured array, one column per field
+
+    `day` is the trip day number counted from `first_day` (day 1), the same
+    as used for day labels on the map.
+    """
+    activities = list(activities)
+    table = np.zeros(len(activities), dtype=[
+        ("id", "i8"),
+        ("date", "datetime64[D]"),
+        ("day", "i4"),
+        ("type", "U32"),
+        ("distance", "f8"),
+        ("elevation", "f8"),
+        ("moving_time", "f8"),
+    ])
+    table["id"] = [activity["id"] for activity in activities]
+    table["date"] = [activity["start_date_local"][:10] for activity in activities]
+    table["day"] = (table["date"] - np.datetime64(first_day, "D")).astype(int) + 1
+    table["type"] = [activity["type"] for activity in activities]
+    table["distance"] = [activity["distance"] for activity in activities]
+    table["elevation"] = [activity.get("total_elevation_gain", 0) for activity in activities]
+    table["moving_time"] = [activity.get("moving_time", 0) for activity in activities]
+    return table
+
+
+def activity_elevation(table, directory=streams.STREAMS_DIR):
+    """Return (N, 3) array of elevation gain, max altitude and max grade per activity
+
+    Values come from the cached streams, NaN for activities without them (or
+    without altitude).
+    """
+    elevation = np.full((len(table), 3), np.nan)
+    for i, activity_id in enumerate(table["id"]):
+        stream = streams.load_stream(int(activity_id), directory)
+        stats = streams.elevation_stats(stream) if stream is not None and len(stream) else None
+        if stats:
+            gain, _, max_altitude, max_grade = stats
+            elevation[i] = gain, max_altitude, max_grade
+    return elevation
+
+
+def daily_stats(table, elevation=None):
+    """Return dict of columns with sums per trip day, ordered by day
+
+    With `elevation` (see activity_elevation()) STREAM_FIELDS are included too.
+    """
+    days, first, inverse = np.unique(table["day"], return_index=True, return_inverse=True)
+    distance = np.bincount(inverse, weights=table["distance"], minlength=len(days)) / 1000
+    daily = {
+        "day": days,
+        "date": table["date"][first],
+        "activities": np.bincount(inverse, minlength=len(days)),
+        "distance_km": distance.round(1),
+        "elevation_m": np.bincount(inverse, weights=table["elevation"], minlength=len(days)).round().astype(int),
+        "moving_time_h": (np.bincount(inverse, weights=table["moving_time"], minlength=len(days))
+                          / 3600).round(1),
+        "total_distance_km": np.cumsum(distance).round(1),
+    }
+    if elevation is not None:
+        has_gain = np.bincount(inverse, weights=~np.isnan(elevation[:, 0]), minlength=len(days)) > 0
+        gain = np.bincount(inverse, weights=np.nan_to_num(elevation[:, 0]), minlength=len(days))
+        daily["stream_gain_m"] = np.where(has_gain, gain.round(), np.nan)
+        for field, column in (("max_altitude_m", 1), ("max_grade_pct", 2)):
+            maximum = np.full(len(days), np.nan)
+            np.fmax.at(maximum, inverse, elevation[:, column])
+            daily[field] = maximum.round(0 if column == 1 else 1)
+    return daily
+
+
+def trip_summary(name, table, daily):
+    """Return dict with totals of a trip"""
+    days = len(daily["day"])
+    distance = float(table["distance"].sum()) / 1000
+    longest = int(np.argmax(daily["distance_km"])) if days else None
+    summary = {
+        "trip": name,
+        "activities": len(table),
+        "hikes": int((table["type"] == "Hike").sum()),
+        "days": days,
+        "distance_km": round(distance, 1),
+        "elevation_m": round(float(table["elevation"].sum())),
+        "moving_time_h": round(float(table["moving_time"].sum()) / 3600, 1),
+        "distance_per_day_km": round(distance / days, 1) if days else 0,
+        "longest_day": int(daily["day"][longest]) if days else None,
+        "longest_day_km": float(daily["distance_km"][longest]) if days else 0,
+    }
+    if "stream_gain_m" in daily:
+        summary["stream_gain_m"] = round(float(np.nansum(daily["stream_gain_m"])))
+        for field in ("max_altitude_m", "max_grade_pct"):
+            values = daily[field][~np.isnan(daily[field])]
+            summary[field] = float(values.max()) if len(values) else None
+    return summary
+
+
+def daily_rows(name, daily):
+    """Yield rows of daily_stats() for csv, missing (NaN) values are None"""
+    fields = [field for field in DAILY_FIELDS[1:] + STREAM_FIELDS if field in daily]
+    for i in range(len(daily["day"])):
+        row = {field: daily[field][i].item() for field in fields}
+        row = {field: None if value != value else value for field, value in row.items()}
+        yield {"trip": name, **row, "date": str(daily["date"][i])}
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compute stats per day and per trip from the local activity store "
+        f"({activity_store.ACTIVITY_STORE}, see build_map.py --sync)"
+    )
+    parser.add_argument("--since", help="Start date (YYYY-MM-DD) of a single trip")
+    parser.add_argument("--until", help="End date (YYYY-MM-DD) of a single trip")
+    parser.add_argument("--first-day", help="Day 1 of a single trip (default: since)")
+    parser.add_argument(
+        "--trips",
+        nargs="?",
+        const=TRIPS_CONFIG,
+        metavar="CONFIG",
+        help=f"Stats of all trips in the trips config (default: {TRIPS_CONFIG})",
+    )
+    parser.add_argument(
+        "--trip", action="append", metavar="NAME", help="Only this trip from the trips config"
+    )
+    parser.add_argument(
+        "--streams",
+        action="store_true",
+        help=f"Add elevation and grade stats from streams cached in {streams.STREAMS_DIR} "
+        "(see build_map.py --streams)",
+    )
+    parser.add_argument("-o", "--output", help="Write daily stats as CSV to this file (default: stdout)")
+    parser.add_argument("--json", metavar="PATH", help="Write daily stats and trip totals as JSON")
+    args = parser.parse_args(argv)
+    if not args.trips and not args.since:
+        parser.error("either --since or --trips is needed")
+    if np is None:
+        parser.error("NumPy is needed for trip stats")
+    return args
+
+
+def main():
+    args = parse_arguments()
+    if args.trips:
+        trips = load_trips(args.trips, args.trip)
+    else:
+        trips = [{"name": args.since, "since": args.since, "until": args.until,
+                  "first_day": args.first_day or args.since}]
+
+    conn = activity_store.open_store(activity_store.ACTIVITY_STORE)
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    fields = DAILY_FIELDS + STREAM_FIELDS if args.streams else DAILY_FIELDS
+    writer = csv.DictWriter(output, fields, lineterminator="\n")
+    writer.writeheader()
+    results = []
+    for trip in trips:
+        activities = activity_store.load_activities(
+            conn, after=date_to_timestamp(trip["since"]), before=date_to_timestamp(trip["until"])
+        )
+        table = activity_table(activities, trip["first_day"])
+        daily = daily_stats(table, activity_elevation(table) if args.streams else None)
+        writer.writerows(daily_rows(trip["name"], daily))
+        summary = trip_summary(trip["name"], table, daily)
+        if args.json:
+            summary["daily"] = list(daily_rows(trip["name"], daily))
+        results.append(summary)
+    conn.close()
+    if args.output:
+        output.close()
+
+    for summary in results:
+        print(
+            f"{summary['trip']}: {summary['days']} days, {summary['activities']} activities, "
+            f"{summary['distance_km']} km, {summary['elevation_m']} m up",
+            file=sys.stderr,
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"generated": datetime.now().isoformat(timespec="seconds"), "trips": results},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
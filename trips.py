@@ -0,0 +1,30 @@
+"""Trips config
+
+The trips config (TRIPS_CONFIG) lists past trips, each with name, since and
+optionally until, first_day, output and csv. build_map.py --trips builds maps
+of all of them, trip_stats.py --trips computes their stats.
+"""
+import json
+import os
+import re
+
+TRIPS_CONFIG = "trips.json"
+TRIPS_OUTPUT_DIR = "maps"
+
+
+def load_trips(path, names=None):
+    """Load trips config, fill in defaults and keep only trips in `names` (if given)"""
+    with open(path) as f:
+        trips = json.load(f)
+    if names:
+        unknown = set(names) - {trip["name"] for trip in trips}
+        if unknown:
+            raise SystemExit(f"Unknown trips: {', '.join(sorted(unknown))}")
+        trips = [trip for trip in trips if trip["name"] in names]
+    for trip in trips:
+        slug = re.sub(r"[^a-z0-9]+", "-", trip["name"].lower()).strip("-")
+        trip.setdefault("until", None)
+        trip.setdefault("first_day", trip["since"])
+        trip.setdefault("output", os.path.join(TRIPS_OUTPUT_DIR, f"{slug}.html"))
+        trip.setdefault("csv", os.path.splitext(trip["output"])[0] + ".csv")
+    return trips
@@ -0,0 +1,23 @@
+"""Web Mercator projection shared by marker clustering and the tile cache
+
+Coordinates are normalized to 0..1 in both directions, multiply by
+TILE_SIZE * 2 ** zoom for pixels or by 2 ** zoom for tiles of a zoom level.
+"""
+import math
+
+TILE_SIZE = 256  # pixels
+MAX_LATITUDE = 85.0511287798
+
+
+def mercator(lat, lng):
+    """Return normalized Web Mercator (x, y), both in 0..1"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = (lng + 180) / 360
+    y = 0.5 - math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) / (2 * math.pi)
+    return x, y
+
+
+def inverse_mercator(x, y):
+    lng = x * 360 - 180
+    lat = math.degrees(2 * math.atan(math.exp((0.5 - y) * 2 * math.pi)) - math.pi / 2)
+    return lat, lng
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Receive Strava webhook events and rebuild the map when activities change
+
+Strava sends a POST with a small JSON event for every created, updated or
+deleted activity of a subscribed athlete
+(https://developers.strava.com/docs/webhooks/). For each event only that
+activity is fetched (or removed) and saved to the local activity store. The map
+is then rebuilt from the store with `build_map.py --sync`, once no new event
+came for DEBOUNCE seconds, so that a burst of events (e.g. an upload followed
+by renaming the activity) leads to a single rebuild. Arguments after -- are
+passed to build_map.py.
+
+Creating the subscription validates the callback url with a GET request
+carrying hub.challenge, which is echoed back if hub.verify_token matches.
+
+Events can be posted locally for testing, e.g. with the fake API from
+benchmarks/fake_strava.py:
+
+    STRAVA_API_URL=http://127.0.0.1:8000 ./webhook_server.py --debounce 5 -- --skip-thunderforest
+    curl -X POST localhost:8080 -d '{"object_type": "activity", "object_id": 1, "aspect_type": "create"}'
+
+Required env vars (either already set, or via .env file):
+STRAVA_WEBHOOK_VERIFY_TOKEN
+and those of get_access_token.py and build_map.py
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from dotenv import load_dotenv
+import requests
+
+from get_access_token import get_access_token
+import activity_store
+from strava_client import StravaClient
+
+BUILD_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "build_map.py")
+
+# Seconds without new events before the map is rebuilt
+DEBOUNCE = 60
+
+# Parts of the detailed activity that list requests don't return, not worth storing
+DETAIL_FIELDS = (
+    "segment_efforts", "splits_metric", "splits_standard", "laps", "best_efforts",
+    "photos", "similar_activities", "stats_visibility", "description",
+)
+
+
+def summary(activity):
+    """Strip detailed activity (GET /activities/{id}) to what activity lists return"""
+    activity = {key: value for key, value in activity.items() if key not in DETAIL_FIELDS}
+    if activity.get("map"):
+        activity["map"] = {key: value for key, value in activity["map"].items() if key != "polyline"}
+    return activity
+
+
+def apply_event(client, event, store_path=activity_store.ACTIVITY_STORE):
+    """Update the activity store according to a webhook event
+
+    Returns True if the store changed and the map needs to be rebuilt.
+    """
+    if event.get("object_type") != "activity":
+        return False
+    activity_id = event["object_id"]
+    conn = activity_store.open_store(store_path)
+    try:
+        if event["aspect_type"] == "delete":
+            activity_store.delete_activity(conn, activity_id)
+            print(f"Deleted activity {activity_id}")
+            return True
+
+        response = client.get(f"/activities/{activity_id}")
+        if response.status_code == requests.codes.not_found:
+            # E.g. made private, so it's not visible with our scope anymore
+            activity_store.delete_activity(conn, activity_id)
+            print(f"Activity {activity_id} not found, deleted")
+            return True
+        if response.status_code != requests.codes.ok:
+            print(f"Failed to get activity {activity_id}: {response.status_code} {response.text}")
+            return False
+        activity = summary(response.json())
+
+        # A new activity must not make the store look synced past activities
+        # we haven't seen (e.g. missed events), fetch the gap first. If that
+        # fails get_activities() raises and the activity isn't saved either.
+        synced_after = activity_store.get_meta(conn, "synced_after")
+        if synced_after is not None:
+            latest = activity_store.latest_start(conn, synced_after) or synced_after
+            start = activity_store.start_timestamp(activity)
+            if start > latest:
+                activity_store.save_activities(
+                    conn, client.get_activities(after=latest, before=start)
+                )
+        activity_store.save_activities(conn, [activity])
+        print(f"Saved activity {activity_id} ({event['aspect_type']})")
+        return True
+    finally:
+        conn.close()
+
+
+def rebuild(build_args):
+    print("Rebuilding map")
+    result = subprocess.run([sys.executable, BUILD_MAP, "--sync", *build_args])
+    print(f"Rebuild finished with status {result.returncode}")
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, verify_token, build_args=(), debounce=DEBOUNCE,
+                 store_path=activity_store.ACTIVITY_STORE):
+        super().__init__(address, WebhookHandler)
+        self.verify_token = verify_token
+        self.build_args = list(build_args)
+        self.debounce = debounce
+        self.store_path = store_path
+        self.events = Queue()
+        self.worker = threading.Thread(target=self.process_events, daemon=True)
+
+    def start_worker(self):
+        self.worker.start()
+        return self
+
+    def stop_worker(self):
+        self.events.put(None)
+        self.worker.join()
+
+    def process_events(self):
+        """Apply events one by one, rebuild once they stop coming for `debounce` seconds"""
+        pending = False
+        while True:
+            try:
+                event = self.events.get(timeout=self.debounce if pending else None)
+            except Empty:
+                rebuild(self.build_args)
+                pending = False
+                continue
+            if event is None:
+                break
+            try:
+                # The token is reused while valid, so this is cheap
+                with StravaClient(get_access_token(), store_path=self.store_path) as client:
+                    pending = apply_event(client, event, self.store_path) or pending
+            except Exception as e:  # Keep serving, the next event may work
+                print(f"Failed to process event {event}: {e!r}")
+        if pending:
+            rebuild(self.build_args)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        """Subscription validation"""
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        if (query.get("hub.mode") != "subscribe"
+                or query.get("hub.verify_token") != self.server.verify_token):
+            self.send_json(403, {"error": "verification failed"})
+            return
+        self.send_json(200, {"hub.challenge": query.get("hub.challenge")})
+
+    def do_POST(self):
+        """Event, Strava expects a response within 2 seconds so it's only queued"""
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            event = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_json(400, {"error": "invalid JSON"})
+            return
+        if not isinstance(event, dict) or "object_id" not in event or "aspect_type" not in event:
+            self.send_json(400, {"error": "not an event"})
+            return
+        self.server.events.put(event)
+        self.send_json(200, {})
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description="Receive Strava webhook events and rebuild the map. "
+        "Arguments after -- are passed to build_map.py."
+    )
+    parser.add_argument("--host", default="", help="Address to listen on (default: all)")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=DEBOUNCE,
+        help=f"Seconds without new events before the map is rebuilt (default: {DEBOUNCE})",
+    )
+    parser.add_argument("build_args", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    server = WebhookServer(
+        (args.host, args.port), os.environ["STRAVA_WEBHOOK_VERIFY_TOKEN"], args.build_args,
+        args.debounce,
+    ).start_worker()
+    print(f"Listening for webhook events on port {args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.stop_worker()
+
+
+if __name__ == "__main__":
+    main()